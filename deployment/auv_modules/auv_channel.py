@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''
+State channel between the read and process modules.
+
+A fixed size ring buffer of typed attitude records, each stamped with a
+sequence number. Modules loaded into the same MAVProxy share one channel
+per name through channel(). With shared=True the buffer lives in a file
+under /dev/shm, so a process outside MAVProxy can follow it too.
+'''
+
+import os
+import numpy
+
+'''Roll-1 Pitch-2 Yaw-3 DesRoll-4 DesPitch-5 DesYaw-6 of the old results.txt, in degrees'''
+ATTITUDE_DTYPE = numpy.dtype([('seq', '<u8'), ('time', '<f8'),
+                              ('roll', '<f4'), ('pitch', '<f4'), ('yaw', '<f4'),
+                              ('des_roll', '<f4'), ('des_pitch', '<f4'), ('des_yaw', '<f4')])
+
+HEADER_DTYPE = numpy.dtype([('seq', '<u8'), ('capacity', '<u4'), ('itemsize', '<u4')])
+
+_channels = {}
+
+
+class StateChannel():
+    '''
+    Single writer ring buffer. Each slot's seq is zeroed while the slot is
+    written and set last, so a reader in another process can tell a torn
+    record from a finished one and simply retries.
+    '''
+    def __init__(self, capacity=256, dtype=ATTITUDE_DTYPE, path=None):
+        self.dtype = dtype
+        size = HEADER_DTYPE.itemsize + capacity * dtype.itemsize
+        if path is None:
+            buf = numpy.zeros(size, numpy.uint8)
+        else:
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                with open(path, 'wb') as f:
+                    f.truncate(size)
+            buf = numpy.memmap(path, numpy.uint8, 'r+', shape=(size,))
+        self.buf = buf
+        self.header = buf[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        self.records = buf[HEADER_DTYPE.itemsize:].view(dtype)
+        if self.header['capacity'][0] != capacity or self.header['itemsize'][0] != dtype.itemsize:
+            self.header['seq'] = 0
+            self.header['capacity'] = capacity
+            self.header['itemsize'] = dtype.itemsize
+            self.records['seq'] = 0
+        self.capacity = capacity
+
+    def seq(self):
+        '''sequence number of the newest record, 0 before the first'''
+        return int(self.header['seq'][0])
+
+    def publish(self, t, *values):
+        '''append one record of TIME and the VALUES after it in the dtype'''
+        seq = self.seq() + 1
+        slot = self.records[seq % self.capacity:seq % self.capacity + 1]
+        slot['seq'] = 0
+        slot['time'] = t
+        for name, v in zip(self.dtype.names[2:], values):
+            slot[name] = v
+        slot['seq'] = seq
+        self.header['seq'] = seq
+        return seq
+
+    def get(self, seq):
+        '''a copy of record SEQ, or None if it has been overwritten or is being written'''
+        i = seq % self.capacity
+        record = self.records[i:i + 1].copy()
+        if record['seq'][0] != seq or self.records['seq'][i] != seq:
+            return None
+        return record[0]
+
+    def latest(self):
+        '''the newest record, None if there is none yet'''
+        for _ in range(3):
+            seq = self.seq()
+            if seq == 0:
+                return None
+            record = self.get(seq)
+            if record is not None:
+                return record
+        return None
+
+    def read_since(self, seq):
+        '''
+        (records, dropped): every record newer than SEQ that is still in the
+        buffer, and how many newer ones were already overwritten
+        '''
+        newest = self.seq()
+        first = max(seq + 1, newest - self.capacity + 1, 1)
+        dropped = max(0, first - seq - 1)
+        n = newest - first + 1
+        if n <= 0:
+            return self.records[:0].copy(), dropped
+        index = numpy.arange(first, newest + 1) % self.capacity
+        out = self.records[index]
+        valid = out['seq'] == numpy.arange(first, newest + 1)
+        return out[valid], dropped + int(n - valid.sum())
+
+    def close(self):
+        if isinstance(self.buf, numpy.memmap):
+            self.buf.flush()
+
+
+def channel(name='attitude', capacity=256, dtype=ATTITUDE_DTYPE, shared=False):
+    '''the channel called NAME, created on first use'''
+    if name not in _channels:
+        path = '/dev/shm/auv_%s' % name if shared else None
+        _channels[name] = StateChannel(capacity, dtype, path)
+    return _channels[name]
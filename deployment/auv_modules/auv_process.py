@@ -19,6 +19,7 @@ import time
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules import auv_channel
 
 
 class process(mp_module.MPModule):
@@ -33,8 +34,18 @@ class process(mp_module.MPModule):
         self.packets_othertarget = 0
         self.verbose = False
 
+        #last state channel record processed
+        self.last_seq = 0
+        self.dropped = 0
+        self.channel = None
+
+        #latest attitude and how far the yaw is off the desired yaw, degrees
+        self.roll = self.pitch = self.yaw = None
+        self.yaw_error = None
+
         self.process_settings = mp_settings.MPSettings(
             [ ('verbose', bool, False),
+              ('shared', bool, False),
           ])
         self.add_command('process', self.cmd_process, "process module", ['status','set (LOGSETTING)'])
 
@@ -57,11 +68,15 @@ class process(mp_module.MPModule):
         '''returns information about module'''
         self.status_callcount += 1
         self.last_bored = time.time() # status entertains us
-        return("status called %(status_callcount)d times.  My target positions=%(packets_mytarget)u  Other target positions=%(packets_mytarget)u" %
-               {"status_callcount": self.status_callcount,
-                "packets_mytarget": self.packets_mytarget,
-                "packets_othertarget": self.packets_othertarget,
-               })
+        status = ("status called %(status_callcount)d times.  My target positions=%(packets_mytarget)u  Other target positions=%(packets_mytarget)u" %
+                  {"status_callcount": self.status_callcount,
+                   "packets_mytarget": self.packets_mytarget,
+                   "packets_othertarget": self.packets_othertarget,
+                  })
+        if self.yaw_error is not None:
+            status += "\nRoll %.1f  Pitch %.1f  Yaw %.1f  Yaw error %.1f  (%u records dropped)" % (
+                self.roll, self.pitch, self.yaw, self.yaw_error, self.dropped)
+        return status
 
     def boredom_message(self):
         if self.process_settings.verbose:
@@ -71,34 +86,38 @@ class process(mp_module.MPModule):
     def idle_task(self):
         '''
         Called rapidly by mavproxy.
-        Unceasingly processes the telemetry data inside the results.txt file.
+        Unceasingly processes the attitude records auv_readSensor.py publishes to the state channel.
         Calculates the necessary roll, pitch, yaw, direction, bearing, etc...
         '''
         now = time.time()
-        if now-self.last_bored > self.boredom_interval:
-            self.last_bored = now
-            message = self.boredom_message()
-            self.say("%s: %s" % (self.name,message))
-            # See if whatever we're connected to would like to play:
-            self.master.mav.statustext_send(mavutil.mavlink.MAV_SEVERITY_NOTICE,
-                                            message)
-
-            #read the results file for data
-            data = open("~/results.txt", "r")
-
-            #use readline(line number) on the line containing the information desired
-            #DATA LINE NUMBERS
-            #Roll-1 Pitch-2 Yaw-3 DesRoll-4 DesPitch-5 DesYaw-6
-            roll = data.readline(1)
-            pitch = data.readline(2)
-            yaw = data.readline(3)
-
-            #Calculate the current roll, pitch, yaw, etc for the AUV
-            #Pitch and roll should be neutral, yaw should be pointing towards destination
-
-             
-
-        #endif
+        if self.channel is None:
+            self.channel = auv_channel.channel('attitude', shared=self.process_settings.shared)
+        if self.channel.seq() == self.last_seq:
+            if now-self.last_bored > self.boredom_interval:
+                self.last_bored = now
+                message = self.boredom_message()
+                self.say("%s: %s" % (self.name,message))
+                # See if whatever we're connected to would like to play:
+                self.master.mav.statustext_send(mavutil.mavlink.MAV_SEVERITY_NOTICE,
+                                                message)
+            return
+        self.last_bored = now
+
+        #every record since the last call, oldest first
+        records, dropped = self.channel.read_since(self.last_seq)
+        self.dropped += dropped
+        if len(records) == 0:
+            return
+        self.last_seq = int(records['seq'][-1])
+        latest = records[-1]
+        self.roll = float(latest['roll'])
+        self.pitch = float(latest['pitch'])
+        self.yaw = float(latest['yaw'])
+
+        #Calculate the current roll, pitch, yaw, etc for the AUV
+        #Pitch and roll should be neutral, yaw should be pointing towards destination
+        #Only reported for now; steering on the error is left to the auto module
+        self.yaw_error = (float(latest['des_yaw']) - self.yaw + 180) % 360 - 180
 
     def mavlink_packet(self, m):
         '''handle mavlink packets'''
@@ -6,6 +6,7 @@ April 2017
 
 This is the module used for reading input data from the I2C port on the Pixhawk. Data is read in and
 sorted and is afterwards passed to auv_process.py for calculating how motors should run.
+Attitude goes to auv_process.py through the auv_channel ring buffer as each packet arrives.
 '''
 
 import os
@@ -14,10 +15,12 @@ import sys
 from pymavlink import mavutil
 import errno
 import time
+import math
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules import auv_channel
 
 
 class read(mp_module.MPModule):
@@ -35,10 +38,15 @@ class read(mp_module.MPModule):
         #True for debugging purposes
         self.verbose = True
 
+        #desired attitude from NAV_CONTROLLER_OUTPUT, degrees
+        self.desired = [0.0, 0.0, 0.0]
+        self.channel = None
+
         self.read_settings = mp_settings.MPSettings(
             [ ('verbose', bool, True),
+              ('shared', bool, False),
           ])
-        self.add_command('read', self.readSensor, "Read data from the Pixhawk's I2C port", ['status','set (LOGSETTING)'])
+        self.add_command('read', self.cmd_read, "Read data from the Pixhawk's I2C port", ['status','set (LOGSETTING)'])
 
     def usage(self):
         '''show help on command line options'''
@@ -68,53 +76,31 @@ class read(mp_module.MPModule):
     def boredom_message(self):
         if self.read_settings.verbose:
             return ("Accessing data from Pixhawk I2C port")
-        return ("Reading I2C on port" + #port number)
+        return ("Reading I2C on port")
 
-    def read(self):
+    def read(self, ATTITUDE):
         '''
-        Called rapidly by mavproxy
-        The main component of this module. A read function that is called rapily and automatically in order to ensure
-        a real time conception of the AUV's navigational information by the Raspberry Pi.
+        Called for every ATTITUDE packet.
+        Publishes roll, pitch, yaw and the desired attitude to the state channel, so auv_process.py
+        sees data as old as the packet instead of re-reading ~/mav.tlog and ~/results.txt.
         '''
-        now = time.time()
-        if now-self.last_bored > self.boredom_interval:
-            self.last_bored = now
-            message = self.boredom_message()
-            self.say("%s: %s" % (self.name,message))
-            # See if whatever we're connected to would like to play:
-            self.master.mav.statustext_send(mavutil.mavlink.MAV_SEVERITY_NOTICE,
-                                            message)
-
-            #Read the I2C port data by accessing a tlog file
-            tlog = open("~/mav.tlog", "r")
-
-            #find out on which line the data resides
-            roll = str(tlog.readline(//linenumber)) #parse the format of the file
-            pitch = str(tlog.readline(//linenumber))
-            yaw = str(tlog.readline(//linenumber))
-
-            #write the data to another file with simple format after reading it
-            #Format is to write data such as height, velocity, etc in a set order, with a new line for each.
-            #This way, in order to access a certain piece of data, just access that line using readline()
-            results = open("~/results.txt", "w")
-
-            #write the data; don't forget an EOL \n character!
-            #DATA LINE NUMBERS
-            #Roll-1 Pitch-2 Yaw-3 DesRoll-4 DesPitch-5 DesYaw-6
-            #
-            results.write(roll + "\n")
-            results.write(pitch + "\n")
-            results.write(yaw + "\n")
-
-
-            #close file
-            results.close()
-
-        #endif
+        if self.channel is None:
+            #shared puts the buffer in /dev/shm for processes outside MAVProxy
+            self.channel = auv_channel.channel('attitude', shared=self.read_settings.shared)
+        self.channel.publish(getattr(ATTITUDE, '_timestamp', time.time()),
+                             math.degrees(ATTITUDE.roll), math.degrees(ATTITUDE.pitch), math.degrees(ATTITUDE.yaw),
+                             self.desired[0], self.desired[1], self.desired[2])
 
     def mavlink_packet(self, m):
         '''handle mavlink packets'''
-        if m.get_type() == 'GLOBAL_POSITION_INT':
+        mtype = m.get_type()
+        if mtype == 'ATTITUDE':
+            self.read(m)
+        elif mtype == 'NAV_CONTROLLER_OUTPUT':
+            self.desired[0] = m.nav_roll
+            self.desired[1] = m.nav_pitch
+            self.desired[2] = m.target_bearing
+        elif mtype == 'GLOBAL_POSITION_INT':
             if self.settings.target_system == 0 or self.settings.target_system == m.get_srcSystem():
                 self.packets_mytarget += 1
             else:
@@ -7,14 +7,15 @@ from pymavlink import mavutil
 
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib.mp_settings import MPSetting
+from MAVProxy.modules import mp_soc
+from MAVProxy.modules import mp_battstats
 
 class BatteryModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(BatteryModule, self).__init__(mpstate, "battery", "battery commands")
-        self.add_command('bat', self.cmd_bat, "show battery information")
+        self.add_command('bat', self.cmd_bat, "show battery information", ['reset'])
         self.last_battery_announce = 0
         self.last_battery_announce_time = 0
-        self.last_battery_cell_announce_time = 0
         self.battery_level = -1
         self.voltage_level = -1
         self.current_battery = -1
@@ -34,18 +35,32 @@ class BatteryModule(mp_module.MPModule):
         self.settings.append(
             MPSetting('vccwarn', float, 4.3, 'Vcc voltage warning level'))
         self.settings.append(MPSetting('numcells', int, 0, range=(0,10), increment=1))
-        self.battery_period = mavutil.periodic_event(5)
+        self.batt_monitor = int(self.get_mav_param('BATT_MONITOR', 0))  # kept current from PARAM_VALUE
+        self.soc = mp_soc.load_soc()  # discharge curve from /home/pi/discharge_curve.txt
+        self.stats = mp_battstats.BatteryStats()
+        self.cell_warning = None  # threshold on the 10s mean cell voltage, set once numcells is known
+        self.threshold_settings = None
+        self.last_status = None
 
     def cmd_bat(self, args):
         '''show battery levels'''
+        if len(args) > 0 and args[0] == 'reset':
+            self.stats.reset_mission()
+        self.battery_status()
         print("Flight battery:   %u%%" % self.battery_level)
         if self.settings.numcells != 0:
             print("%.2f V/cell for %u cells - approx %u%%" % (self.per_cell,
                                                               self.settings.numcells,
                                                               self.vcell_to_battery_percent(self.per_cell)))
+        if self.voltage_level != -1:
+            print("Load compensated: approx %u%%" % self.percentage())
+        print("min/mean/max")
+        for line in self.stats.report():
+            print(line)
 
-    def battery_report(self):
-        batt_mon = int(self.get_mav_param('BATT_MONITOR',0))
+    def battery_status(self):
+        '''refresh the console status line'''
+        batt_mon = self.batt_monitor
 
         #report voltage level only
         battery_string = ''
@@ -56,38 +71,38 @@ class BatteryModule(mp_module.MPModule):
         if self.battery2_voltage != -1:
             battery_string += ' %.2fV' % self.battery2_voltage
 
-        self.console.set_status('Battery', battery_string, row=1)
+        if battery_string != self.last_status:
+            self.console.set_status('Battery', battery_string, row=1)
+            self.last_status = battery_string
 
-        rbattery_level = int((self.battery_level+5)/10)*10
-        if batt_mon >= 4 and self.settings.battwarn > 0 and time.time() > self.last_battery_announce_time + 60*self.settings.battwarn:
+    def battery_announce(self, rbattery_level):
+        '''the remaining charge moved to another 10% step'''
+        self.last_battery_announce = rbattery_level
+        self.battery_status()
+        if self.batt_monitor >= 4 and self.settings.battwarn > 0 and time.time() > self.last_battery_announce_time + 60*self.settings.battwarn:
             self.last_battery_announce_time = time.time()
-            if rbattery_level != self.last_battery_announce:
-                self.say("Flight battery %u percent" % rbattery_level, priority='notification')
-                self.last_battery_announce = rbattery_level
-            #check voltage level to ensure we've actually received data about
-            #the battery (prevents false positive warning at startup)
-            if self.voltage_level != -1 and rbattery_level <= 20:
-                self.say("Flight battery warning")
-
-        if self.settings.numcells != 0 and self.per_cell < self.settings.batwarncell and time.time() > self.last_battery_cell_announce_time + 60*self.settings.battwarn:
-            self.say("Cell warning")
-            self.last_battery_cell_announce_time = time.time()
+            self.say("Flight battery %u percent" % rbattery_level, priority='notification')
+        #check voltage level to ensure we've actually received data about
+        #the battery (prevents false positive warning at startup)
+        if self.batt_monitor >= 4 and self.voltage_level != -1 and rbattery_level <= 20:
+            self.say("Flight battery warning")
+
+    def battery_thresholds(self):
+        '''(re)arm the thresholds that depend on the settings'''
+        cells = self.settings.numcells
+        self.stats.thresholds = []
+        self.cell_warning = None
+        if cells != 0:
+            self.cell_warning = mp_battstats.Threshold('cell', '10s', 'voltage', 'mean',
+                                                       cells * self.settings.batwarncell, hysteresis=0.05 * cells)
+            self.stats.thresholds.append(self.cell_warning)
+        self.threshold_settings = (cells, self.settings.batwarncell)
 
 
     def vcell_to_battery_percent(self, vcell):
-        '''convert a cell voltage to an approximate
-        percentage battery level for a LiPO'''
-        if vcell > 4.1:
-            # above 4.1 is 100% battery
-            return 100.0
-        elif vcell > 3.81:
-            # 3.81 is 17% remaining, from flight logs
-            return 17.0 + 83.0 * (vcell - 3.81) / (4.1 - 3.81)
-        elif vcell > 3.2:
-            # below 3.2 it degrades fast. It's dead at 3.2
-            return 0.0 + 17.0 * (vcell - 3.20) / (3.81 - 3.20)
-        # it's dead or disconnected
-        return 0.0
+        '''convert a resting cell voltage to an approximate
+        percentage battery level from the discharge curve'''
+        return self.soc.cell_percent(vcell)
 
 
     def battery_update(self, SYS_STATUS):
@@ -98,6 +113,17 @@ class BatteryModule(mp_module.MPModule):
         self.current_battery = SYS_STATUS.current_battery
         if self.settings.numcells != 0:
             self.per_cell = (self.voltage_level*0.001) / self.settings.numcells
+        if self.threshold_settings != (self.settings.numcells, self.settings.batwarncell):
+            self.battery_thresholds()
+        amps = max(self.current_battery, 0) * 0.01
+        for name, crossed in self.stats.add(SYS_STATUS._timestamp, self.voltage_level * 0.001, amps):
+            if name == 'cell' and crossed:
+                self.say("Cell warning")
+            self.battery_status()
+        # the console and announcements only hear of steps and crossings, not every reading
+        rbattery_level = int((self.battery_level+5)/10)*10
+        if rbattery_level != self.last_battery_announce:
+            self.battery_announce(rbattery_level)
 
     def power_status_update(self, POWER_STATUS):
         '''update POWER_STATUS warnings level'''
@@ -121,19 +147,22 @@ class BatteryModule(mp_module.MPModule):
 
     #Send battery percentage to profalgo
     def percentage(self):
-        return self.vcell_to_battery_percent(self, self.per_cell)
+        '''load compensated percentage from the latest SYS_STATUS'''
+        return self.soc.percent(self.voltage_level, self.current_battery, self.settings.numcells or None)
 
     def mavlink_packet(self, m):
         '''handle a mavlink packet'''
         mtype = m.get_type()
+        # reports are driven from SYS_STATUS, other packets cost a type check
         if mtype == "SYS_STATUS":
             self.battery_update(m)
-        if mtype == "BATTERY2":
+        elif mtype == "BATTERY2":
             self.battery2_voltage = m.voltage * 0.001
-        if mtype == "POWER_STATUS":
+        elif mtype == "POWER_STATUS":
             self.power_status_update(m)
-        if self.battery_period.trigger():
-            self.battery_report()
+        elif mtype == "PARAM_VALUE" and m.param_id == "BATT_MONITOR":
+            self.batt_monitor = int(m.param_value)
+            self.battery_status()
 
 def init(mpstate):
     '''initialise module'''
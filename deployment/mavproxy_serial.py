@@ -2,32 +2,196 @@
 '''serial_control MAVLink handling'''
 
 import time, os, fnmatch, sys
+import collections
+import io
+import threading
 from pymavlink import mavutil, mavwp
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import mp_module
 
+FRAME_SIZE = 70  # data bytes in one SERIAL_CONTROL
+ACK_TIMEOUT = 1.0  # seconds beyond the reply timeout before an unanswered frame is given up
+
+
+class SerialStream(io.RawIOBase):
+    '''
+    Byte stream over SERIAL_CONTROL. write() queues bytes which pump()
+    sends in 70 byte frames, each asking for a reply, with at most WINDOW
+    frames unanswered at a time. Frames ask the autopilot to block on a
+    full port rather than drop, so the replies pace the upload to what
+    the port takes. Reply bytes are gathered in one buffer that read()
+    and readline() consume, waiting up to TIMEOUT seconds for data (None
+    for ever). Only wait from a thread other than MAVProxy's, which is
+    the one delivering the replies.
+    '''
+    def __init__(self, settings, window=4, timeout=0, max_buffer=1 << 20):
+        io.RawIOBase.__init__(self)
+        self.settings = settings
+        self.window = window
+        self.timeout = timeout
+        self.max_buffer = max_buffer
+        self.exclusive = False
+        self.outbound = bytearray()
+        self.inbound = bytearray()
+        self.in_flight = collections.deque()  # [send time, multi, poll, had data, bytes] per frame
+        self.polling = False  # ask for replies while nothing else is in flight
+        self.condition = threading.Condition()
+        self.frames = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.lost = 0
+        self.dropped = 0
+        self.burst_start = None
+        self.burst_bytes = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytearray(data)
+        with self.condition:
+            if not self.outbound and not self.in_flight:
+                self.burst_start = None
+                self.burst_bytes = 0
+            self.outbound += data
+            self.polling = True
+        return len(data)
+
+    def readinto(self, b):
+        '''up to len(B) reply bytes, none if none came within the timeout, as from a serial port'''
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self.condition:
+            self.polling = True
+            while not self.inbound:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return 0
+                self.condition.wait(remaining)
+            n = min(len(b), len(self.inbound))
+            b[:n] = bytes(self.inbound[:n])
+            del self.inbound[:n]
+            return n
+
+    def available(self):
+        return len(self.inbound)
+
+    def pending(self):
+        '''bytes not yet acknowledged by the autopilot'''
+        return len(self.outbound) + sum(f[4] for f in self.in_flight)
+
+    def flags(self):
+        flags = mavutil.mavlink.SERIAL_CONTROL_FLAG_RESPOND | mavutil.mavlink.SERIAL_CONTROL_FLAG_BLOCKING
+        if self.exclusive:
+            flags |= mavutil.mavlink.SERIAL_CONTROL_FLAG_EXCLUSIVE
+        return flags
+
+    def send_frame(self, mav, data, now, poll):
+        '''one frame; data frames are answered at once, polls wait the timeout for output'''
+        flags = self.flags()
+        timeout = 0
+        multi = False
+        if poll:
+            timeout = self.settings.timeout
+            multi = timeout >= 500
+            if multi:
+                flags |= mavutil.mavlink.SERIAL_CONTROL_FLAG_MULTI
+        buf = list(data)
+        buf.extend([0] * (FRAME_SIZE - len(buf)))
+        mav.serial_control_send(self.settings.port, flags, timeout, self.settings.baudrate, len(data), buf)
+        self.in_flight.append([now, multi, poll, False, len(data)])
+        self.frames += 1
+
+    def pump(self, mav, now):
+        '''send what the window allows, called from the MAVProxy thread'''
+        with self.condition:
+            limit = self.settings.timeout * 1.0e-3 + ACK_TIMEOUT
+            while self.in_flight and now - self.in_flight[0][0] > limit:
+                self.in_flight.popleft()
+                self.lost += 1
+            while self.outbound and len(self.in_flight) < self.window:
+                if self.burst_start is None:
+                    self.burst_start = now
+                chunk = self.outbound[:FRAME_SIZE]
+                del self.outbound[:FRAME_SIZE]
+                self.send_frame(mav, chunk, now, False)
+                self.bytes_sent += len(chunk)
+                self.burst_bytes += len(chunk)
+            if self.polling and not self.outbound and not self.in_flight:
+                self.send_frame(mav, bytearray(), now, True)
+
+    def handle(self, m):
+        '''take in one SERIAL_CONTROL reply, returning its data'''
+        if not m.flags & mavutil.mavlink.SERIAL_CONTROL_FLAG_REPLY:
+            return None
+        data = bytearray(m.data[:m.count])
+        with self.condition:
+            if data:
+                self.inbound += data
+                self.bytes_received += len(data)
+                if len(self.inbound) > self.max_buffer:
+                    excess = len(self.inbound) - self.max_buffer
+                    del self.inbound[:excess]
+                    self.dropped += excess
+                self.condition.notify_all()
+            if self.in_flight:
+                frame = self.in_flight[0]
+                if data:
+                    frame[3] = True
+                if not frame[1] or not data:
+                    # a MULTI poll ends with an empty reply
+                    self.in_flight.popleft()
+                    if frame[2] and not frame[3]:
+                        self.polling = False  # the port has gone quiet
+        return data
+
+    def rate(self, now):
+        '''bytes per second of the current or last upload'''
+        if self.burst_start is None or now <= self.burst_start:
+            return 0.0
+        return self.burst_bytes / (now - self.burst_start)
+
+
 class SerialModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(SerialModule, self).__init__(mpstate, "serial", "serial control handling")
         self.add_command('serial', self.cmd_serial,
                          'remote serial control',
-                         ['<lock|unlock|send>',
+                         ['<lock|unlock|send|upload|status>',
                           'set (SERIALSETTING)'])
         self.serial_settings = mp_settings.MPSettings(
             [ ('port', int, 0),
               ('baudrate', int, 57600),
-              ('timeout', int, 500)
+              ('timeout', int, 500),
+              ('window', int, 4),
+              ('echo', bool, True)
               ]
             )
         self.add_completion_function('(SERIALSETTING)', self.serial_settings.completion)
         self.locked = False
+        self.stream = SerialStream(self.serial_settings, self.serial_settings.window)
+        self.echo = bytearray()
 
     def mavlink_packet(self, m):
         '''handle an incoming mavlink packet'''
         if m.get_type() == 'SERIAL_CONTROL':
-            data = m.data[:m.count]
-            s = ''.join(str(chr(x)) for x in data)
-            sys.stdout.write(s)
+            data = self.stream.handle(m)
+            if data and self.serial_settings.echo:
+                self.echo += data
+
+    def idle_task(self):
+        '''send queued frames and print the replies gathered since the last call'''
+        self.stream.window = self.serial_settings.window
+        self.stream.pump(self.master.mav, time.time())
+        if self.echo:
+            if sys.version_info[0] >= 3:
+                sys.stdout.buffer.write(self.echo)
+            else:
+                sys.stdout.write(str(self.echo))
+            sys.stdout.flush()
+            self.echo = bytearray()
 
     def serial_lock(self, lock):
         '''lock or unlock the port'''
@@ -38,35 +202,33 @@ class SerialModule(mp_module.MPModule):
         else:
             flags = 0
             self.locked = False
+        self.stream.exclusive = self.locked
         mav.serial_control_send(self.serial_settings.port,
                                 flags,
                                 0, 0, 0, [0]*70)
 
     def serial_send(self, args):
         '''send some bytes'''
-        mav = self.master.mav
-        flags = 0
-        if self.locked:
-            flags |= mavutil.mavlink.SERIAL_CONTROL_FLAG_EXCLUSIVE
-        if self.serial_settings.timeout != 0:
-            flags |= mavutil.mavlink.SERIAL_CONTROL_FLAG_RESPOND
-        if self.serial_settings.timeout >= 500:
-            flags |= mavutil.mavlink.SERIAL_CONTROL_FLAG_MULTI
-
         s = ' '.join(args)
         s = s.replace('\\r', '\r')
         s = s.replace('\\n', '\n')
-        buf = [ord(x) for x in s]
-        buf.extend([0]*(70-len(buf)))
-        mav.serial_control_send(self.serial_settings.port,
-                                flags,
-                                self.serial_settings.timeout,
-                                self.serial_settings.baudrate,
-                                len(s), buf)
+        self.stream.write(bytearray(ord(x) for x in s))
+
+    def serial_upload(self, filename):
+        '''send the contents of a file'''
+        with open(filename, 'rb') as f:
+            n = self.stream.write(f.read())
+        print("Queued %u bytes from %s" % (n, filename))
+
+    def serial_status(self):
+        s = self.stream
+        print("Sent %u bytes in %u frames at %.0f bytes/s, %u pending, %u frames in flight, %u unanswered" % (
+            s.bytes_sent, s.frames, s.rate(time.time()), s.pending(), len(s.in_flight), s.lost))
+        print("Received %u bytes, %u buffered, %u dropped" % (s.bytes_received, s.available(), s.dropped))
 
     def cmd_serial(self, args):
         '''serial control commands'''
-        usage = "Usage: serial <lock|unlock|set|send>"
+        usage = "Usage: serial <lock|unlock|set|send|upload|status>"
         if len(args) < 1:
             print(usage)
             return
@@ -78,6 +240,10 @@ class SerialModule(mp_module.MPModule):
             self.serial_settings.command(args[1:])
         elif args[0] == "send":
             self.serial_send(args[1:])
+        elif args[0] == "upload" and len(args) == 2:
+            self.serial_upload(args[1])
+        elif args[0] == "status":
+            self.serial_status()
         else:
             print(usage)
 
@@ -17,7 +17,22 @@ from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules import mp_waypoint
 from MAVProxy.modules import mp_rc
 from MAVProxy.modules import mp_fence
-from MAVProxy.modules import SerialReader
+from MAVProxy.modules import mp_pollution
+from MAVProxy.modules import mp_field
+from MAVProxy.modules import mp_gradient
+from MAVProxy.modules import mp_detect
+from MAVProxy.modules import mp_poi
+from MAVProxy.modules import mp_plan
+from MAVProxy.modules import mp_energy
+from MAVProxy.modules import mp_deadreckon
+from MAVProxy.modules import mp_control
+from MAVProxy.modules import mp_navstate
+try:
+    from MAVProxy.modules import SerialReader
+except ImportError:
+    SerialReader = None  # no sensor board GPIO off the Pi, e.g. under mp_replay
+
+DATA_DIR = '/home/pi'  # maps, calibrations and logs; mp_replay points this elsewhere
 
 
 class AUVModule(mp_module.MPModule):
@@ -27,10 +42,20 @@ class AUVModule(mp_module.MPModule):
 
         '''Navigational information'''
         self.next_wp = []  # lat,lng
+        self.distance_to_waypoint = 0
         self.offset_from_intended_heading = 0
-        self.pollution_array = numpy.zeros([2, 2])  # initialize later
+        self.pollution_map = mp_pollution.PollutionMapFile(os.path.join(DATA_DIR, 'pollution_map.dat'))  # reopened after a restart
+        self.field_estimate = mp_field.FieldEstimator()  # interpolated between samples
+        self.gradient_estimate = mp_gradient.GradientEstimator()  # plane fit of pollution (negated DO) over the latest samples
+        self.detectors = {'DO': mp_detect.ChangeDetector(direction=-1),  # oxygen drops in a plume
+                          'Cond': mp_detect.ChangeDetector(direction=1)}
+        self.fence_extent = (0, 0)  # width, length
         self.loops = 0
-        self.xy = {'x': 0, 'y': 0}  # x,y
+        self.xy = {'x': 0, 'y': 0}  # x,y metres east and north of the map origin
+        self.xy_std = None  # metres, None until the first GPS fix
+        self.dead_reckoning = mp_deadreckon.DeadReckoner()  # keeps xy up to date while submerged
+        self.points_of_interest = []  # x,y of dense traversal triggers
+        self.poi_scores = []  # how far the triggering reading was from baseline, per point of interest
 
         '''Attitude'''
         self.lat = 0
@@ -41,17 +66,24 @@ class AUVModule(mp_module.MPModule):
         self.vy = 1
         self.vz = 1
         self.hdg = 0
+        self.yaw = None  # degrees from ATTITUDE
+
+        '''Pressure and Depth Sensors'''
+        self.temp_sensor = [0] * 3
+        self.depth_sensor = [0] * 3
+        self.depth_control = mp_control.DepthController()
+        self.depth_command = False  # a queued depth change is in progress
+        # fused state the heading and depth loops run on, shared with the nav module
+        self.nav = mp_navstate.fusion(20, os.path.join(DATA_DIR, 'surface_pressure.txt'))
+        self.depth_gauge = self.nav.gauge  # surface pressure cached across restarts
+        self.nav.topic.subscribe(self.nav_update)
 
         '''Battery information'''
         self.battery_level = -1
         self.voltage_level = -1
         self.current_battery = -1
-        self.last_batt = time.time()
-        self.ujoules = 0
-
-        '''Pressure and Depth Sensors'''
-        self.temp_sensor = [0] * 3
-        self.depth_sensor = [0] * 3
+        self.energy = mp_energy.EnergyAccountant()  # joules per segment, axis and phase
+        self.energy_model = mp_energy.load_model(os.path.join(DATA_DIR, 'energy_model.json'))  # fitted from motor_battery.txt
 
         self.last_waypoint = None
 
@@ -60,6 +92,10 @@ class AUVModule(mp_module.MPModule):
         self.mission_running = False
         self.end_time = 0
         self.motor_run_time = 0
+        self.motor_axis = 'idle'
+        self.motor_pwm = 1500
+        self.phase = 'idle'  # mission phase of the queued commands, see mp_plan.PHASES
+        self.heading_control = mp_control.HeadingController()
 
         self.last_sample = time.time()
 
@@ -67,16 +103,16 @@ class AUVModule(mp_module.MPModule):
         self.wp_manager = mp_waypoint.WPManager(self.master, self.target_system, self.target_component)
         self.rc_manager = mp_rc.RCManager(self.master, self.target_system, self.target_component)
         self.fence_manager = mp_fence.FenceManager(self.master, self.target_system, self.target_component, self.console)
-        self.sensor_reader = SerialReader.SerialReader()
+        self.sensor_reader = SerialReader.SerialReader() if SerialReader is not None else None
 
         ''' Commands for operating the module from the MAVProxy CLI'''
-        self.add_command('auto', self.cmd_auto, "Autonomous sampling traversal", ['test','surface', 'underwater', 'setfence'])
+        self.add_command('auto', self.cmd_auto, "Autonomous sampling traversal", ['test','surface', 'underwater', 'setfence', 'poi', 'plan', 'depth', 'energy'])
         self.add_command('dense', self.cmd_dense, "dense traversal", ['start'])
         self.add_command('unittest', self.cmd_unittest, "unit tests", ['<1|2|3|4|5|6|7>'])
 
     def usage(self):
         '''show help on command line options'''
-        return "Usage: auto <dense|setfence|surface|underwater>"
+        return "Usage: auto <dense|setfence|surface|underwater|poi|plan|depth|energy>"
 
     def cmd_auto(self, args):
         '''control behaviour of the module'''
@@ -91,6 +127,14 @@ class AUVModule(mp_module.MPModule):
             print self.cmd_geofence(args[1:])
         elif args[0] == "test":
             print self.cmd_unittest(args[1:])
+        elif args[0] == "poi":
+            self.cmd_poi()
+        elif args[0] == "plan":
+            print self.cmd_plan(args[1:])
+        elif args[0] == "depth":
+            print self.cmd_depth(args[1:])
+        elif args[0] == "energy":
+            print self.cmd_energy()
         else:
             print self.usage()
 
@@ -147,6 +191,64 @@ class AUVModule(mp_module.MPModule):
         '''move backward for 3 seconds'''
         self.command_queue.put(['f', 1450, 3])
 
+    def cmd_poi(self):
+        '''load the points of interest as a mission in the shortest order found'''
+        if len(self.points_of_interest) == 0:
+            print("No points of interest")
+            return
+        centroids = mp_poi.merge_points(self.points_of_interest, 3, self.poi_scores)[0]
+        order = mp_poi.plan_tour(centroids, (self.xy['x'], self.xy['y']))
+        points = mp_poi.tour_latlon(centroids, order, self.pollution_map.origin)
+        self.wp_manager.load_points(points)
+
+    def cmd_plan(self, args):
+        '''compile a lawnmower survey, report its cost and queue it'''
+        if len(args) != 3:
+            return "Usage: auto plan legs leg_length spacing"
+        builder = mp_plan.PlanBuilder(self.energy_model)
+        builder.lawnmower(int(args[0]), float(args[1]), float(args[2]))
+        plan = builder.compile()
+        for phase, (seconds, metres, joules) in sorted(mp_plan.phase_totals(plan).items()):
+            print("%-8s %7.0fs %7.0fm %8.0fJ" % (phase, seconds, metres, joules))
+        if self.predive_check(plan) is not True:
+            return "Insufficient Battery for %.0fJ" % mp_plan.totals(plan)[2]
+        self.load_plan(plan)
+        return "Plan: %u maneuvers, %.0fs, %.0fm, %.0fJ" % ((len(plan),) + mp_plan.totals(plan))
+
+    def cmd_depth(self, args):
+        '''surface calibration, depth hold and its error statistics'''
+        if len(args) == 0:
+            stats = self.depth_control.stats()
+            hold = "holding %.2fm" % self.depth_control.target if self.depth_control.active else "no hold"
+            if stats is None:
+                return "Depth %.2fm, %s" % (self.depth_gauge.depth, hold)
+            return "Depth %.2fm, %s, arrived in %.1fs, error mean %.3fm rms %.3fm max %.3fm" % (
+                (self.depth_gauge.depth, hold) + stats)
+        elif args[0] == "calibrate":
+            self.depth_gauge.calibrate()
+            return "Calibrating surface pressure"
+        elif args[0] == "off":
+            self.depth_control.release()
+            return "Depth hold released"
+        else:
+            self.dive(float(args[0]))
+            return "Queued depth %.2fm" % float(args[0])
+
+    def cmd_energy(self):
+        '''energy used so far, by phase and by axis'''
+        for name, joules in sorted(self.energy.report().items()):
+            print("%-10s %8.0fJ" % (name, joules))
+        return "Energy: %.0fJ over %.0fs, %.1fW" % (self.energy.total, self.energy.seconds, self.energy.watts())
+
+    def load_plan(self, plan):
+        '''queue every maneuver of a compiled plan, marking where its phase changes'''
+        phase = None
+        for command, i in zip(mp_plan.commands(plan, self.energy_model.yaw_seconds, self.depth_control.timeout), plan['phase']):
+            if mp_plan.PHASES[i] != phase:
+                phase = mp_plan.PHASES[i]
+                self.command_queue.put(['phase', phase])
+            self.command_queue.put(command)
+
     def cmd_underwater(self, args):
         if args[0] == "start":
             self.run()
@@ -161,19 +263,18 @@ class AUVModule(mp_module.MPModule):
             # set the apm mav_type
             mav.mode_mapping()
 
-            if self.predive_check() is not True:
-                return "Insufficient Battery"
-
             self.distance_to_waypoint = mp_util.gps_distance(self.lat, self.lon,
                                                              self.next_wp.MAVLink_mission_item_message.x, self.next_wp.MAVLink_mission_item_message.y)
 
+            if self.predive_check() is not True:
+                return "Insufficient Battery"
+
             self.offset_from_intended_heading = mp_util.gps_bearing(self.lat, self.lon,
                                                         self.next_wp.MAVLink_mission_item_message.x, self.next_wp.MAVLink_mission_item_message.y)
 
-            self.orient_heading(self.offset_from_intended_heading)
+            self.face_heading(self.offset_from_intended_heading)
 
-            array_edges = self.calculate_geofence_edge_lengths()
-            self.pollution_array = numpy.zeros([array_edges[0], array_edges[1]], float, 'C')  # each square meter is a point
+            self.fence_extent = self.calculate_geofence_edge_lengths()
 
             # self.dive()
 
@@ -186,9 +287,24 @@ class AUVModule(mp_module.MPModule):
         # else:
         #     sleep(120)
 
-        numpy.savetxt('pollution_array.txt', self.pollution_array)
+        self.pollution_map.flush()
         return
 
+    def predive_check(self, plan=None):
+        '''
+        True if PLAN, or the dive, leg to the next waypoint and surfacing,
+        fits in the remaining charge according to the fitted energy model
+        '''
+        if self.battery_level < 0:
+            return False
+        if plan is None:
+            builder = mp_plan.PlanBuilder(self.energy_model)
+            builder.dive()
+            builder.forward(self.distance_to_waypoint)
+            builder.surface()
+            plan = builder.compile()
+        return mp_energy.feasible(mp_plan.totals(plan)[2], self.battery_level)
+
     def cmd_geofence(self, args):
         return "Not yet implemented"
 
@@ -208,25 +324,68 @@ class AUVModule(mp_module.MPModule):
     def load_geofence_points(self, filename):
         self.fence_manager.cmd_fence(['load', filename])
 
+    # turns are closed loop: the segment lasts until the heading settles
     def orient_heading(self, offset_from_intended_heading, pwm=1550):
-        diff = abs(pwm - 1500)
-        ccw_pwm = 1500 - diff
-        cw_pwm = 1500 + diff
-        if offset_from_intended_heading > 0:
-            self.command_queue.put(['yaw', ccw_pwm, 2])
-            print("orienting!")
+        '''turn OFFSET degrees, positive ccw, with at most PWM of yaw'''
+        self.command_queue.put(['turn', offset_from_intended_heading, abs(pwm - 1500)])
+
+    def face_heading(self, bearing, pwm=1550):
+        '''turn to the compass BEARING'''
+        self.command_queue.put(['heading', bearing, abs(pwm - 1500)])
+
+    def current_heading(self):
+        '''degrees, preferring ATTITUDE over the slower GLOBAL_POSITION_INT'''
+        if self.nav.measured_heading is not None:
+            return self.nav.measured_heading
+        return self.hdg / 100.0
+
+    def start_turn(self, command):
+        '''begin a queued turn or heading command'''
+        heading = self.current_heading()
+        if command[0] == 'turn':
+            target = heading - command[1]
         else:
-            self.command_queue.put(['yaw', cw_pwm, 2])
-            print("otherwise!")
+            target = command[1]
+        self.heading_control.start(target, heading, time.time(), command[2])
+        self.end_time = time.time() + self.heading_control.timeout
+        self.motor_axis = 'yaw'
+        self.motor_pwm = 1500 + command[2]
+
+    def heading_update(self, heading, rate):
+        '''run the heading loop on fresh attitude'''
+        pwm = self.heading_control.update(heading, rate, time.time())
+        if pwm is None:
+            report = self.heading_control.report
+            print("turned %.0f deg in %.1fs, overshoot %.1f deg" % (report['turn'], report['time'], report['overshoot']))
+            self.motor_run_time = report['time']
+            self.end_time = time.time()  # idle_task moves on to the next command
+        elif pwm != self.rc_manager.override[3]:
+            self.rc_manager.override[3] = pwm
+            self.rc_manager.send_rc_override()
 
-    def surface(self, time=5):
-        self.command_queue.put(['z', 1600, time])
+    # depth is held closed loop from SCALED_PRESSURE until the next depth command
+    def surface(self):
+        self.command_queue.put(['depth', 0, self.depth_control.timeout])
         return
 
-    def dive(self, time=3):
-        self.command_queue.put(['z', 1400, time])
+    def dive(self, depth=1.0):
+        self.command_queue.put(['depth', depth, self.depth_control.timeout])
         return
 
+    def depth_update(self, depth):
+        '''run the depth loop on a fresh pressure reading'''
+        pwm = self.depth_control.update(depth, time.time())
+        if self.depth_command and (self.depth_control.arrived is not None or not self.depth_control.active):
+            # the queued dive or surface is done, the hold carries on under the next segments
+            self.depth_command = False
+            self.motor_run_time = time.time() - self.depth_control.start_time
+            self.end_time = time.time()
+        if not self.depth_control.active:
+            print(self.cmd_depth([]))
+        if pwm != self.rc_manager.override[1]:
+            self.rc_manager.override[1] = pwm
+            self.rc_manager.send_rc_override()
+
     # traverse
     # assuming: one second = one meter, 2 seconds delay
     def traverse(self, time=3):
@@ -234,27 +393,52 @@ class AUVModule(mp_module.MPModule):
         print "traversing!"
         return
 
-    # test threshold is 0.7, real threshold value will be pulled from environmental data
+    # returns True when a sensor channel has shifted away from its baseline
     def sample(self):
-        with open("/home/pi/sensor_battery.txt", "a+") as f:
-            f.write("DO: %s, Cond: %s, Temp: %s, Lat: %s, Long: %s, uWatts: %s, Time: " % (self.sensor_reader.read("2").rstrip(), self.sensor_reader.read("3").rstrip(), self.temp_sensor[2], self.lat, self.lon, self.batt_info()) + time.strftime("%H:%M:%S") + "\n")  # DO, Conductivity, Temperature, Lat, Lng, microWatts
-        # pollution_array[self.xy['x']][self.xy['y']] = pollution_value
-        return
+        if self.sensor_reader is None:
+            return False
+        dissolved_oxygen = self.sensor_reader.read("2").rstrip()
+        conductivity = self.sensor_reader.read("3").rstrip()
+        with open(os.path.join(DATA_DIR, "sensor_battery.txt"), "a+") as f:
+            f.write("DO: %s, Cond: %s, Temp: %s, Lat: %s, Long: %s, uWatts: %s, Time: " % (dissolved_oxygen, conductivity, self.temp_sensor[2], self.lat, self.lon, self.batt_info()) + time.strftime("%H:%M:%S") + "\n")  # DO, Conductivity, Temperature, Lat, Lng, microWatts
+        try:
+            reading = float(dissolved_oxygen)
+        except ValueError:
+            reading = None  # sensor returned an error string instead of a reading
+        if reading is not None:
+            self.pollution_map.add(self.xy['x'], self.xy['y'], reading)
+            self.field_estimate.add(self.xy['x'], self.xy['y'], reading)
+            self.gradient_estimate.add(self.xy['x'], self.xy['y'], -reading)  # oxygen drops toward the source
+        score = None
+        for channel, value in (('DO', dissolved_oxygen), ('Cond', conductivity.split(',')[0])):
+            try:
+                event = self.detectors[channel].update(float(value))
+            except ValueError:
+                continue
+            if event is not None:
+                print("%s %s (confidence %.2f)" % (channel, event[0], event[1]))
+                if event[0] == 'trigger':
+                    z = self.detectors[channel].score(float(value))
+                    score = z if score is None else max(score, z)
+        if score is not None:
+            self.points_of_interest.append((self.xy['x'], self.xy['y']))
+            self.poi_scores.append(score)
+        return score is not None
 
     def batt_info(self):
         return float(self.current_battery) * float(self.voltage_level)  # micro-watts
 
     # underwater sparse traverse function
     def underwater_traverse(self, start, end, distance, heading, current=1):
-        start_time = int(time.time())
         end_time = int(time.time()) + distance + 1  # seconds
         '''Measure the run times and order of how this code segment runs'''
         while end_time - int(time.time()) >= 0:
             self.traverse()
             if self.sample():
-                elapsed_time = (int(time.time()) - start_time) + start_time
-                remaining_distance = end_time - self.dense_traverse(elapsed_time, elapsed_time+5, channel, end_time - int(time.time()), self.loops, heading, 5, 2, 1) - elapsed_time
-                end_time = int(time.time()) + remaining_distance + 1
+                # the dense pass covers part of the leg, at one metre a second
+                travelled = self.dense_traverse(forward_distance_to_edge=end_time - int(time.time()),
+                                                loop_number=self.loops, current=current)
+                end_time += 1 - travelled
         else:
             self.stop_motor()
             if distance == 1:
@@ -273,13 +457,21 @@ class AUVModule(mp_module.MPModule):
 
         print "TWO"
         start_time = int(time.time())
+        self.command_queue.put(['phase', 'dense'])
 
-        self.orient_heading(90, pwm)
+        # advance up the plume instead of straight ahead
+        gradient_offset = self.gradient_offset()
+        if gradient_offset != 0:
+            self.orient_heading(gradient_offset, pwm)
+
+        # sweep first to the side the interpolated field puts deeper in the plume
+        side = self.dense_side(self.current_heading() - gradient_offset, sideways_distance)
+        self.orient_heading(90 * side, pwm)
         print "THREE"
         self.traverse(sideways_distance)
         print "FOUR"
 
-        turn_direction = -90
+        turn_direction = -90 * side
         for j in xrange(forward_travel_distance):
             self.orient_heading(turn_direction, pwm)
             self.traverse(forward_increment)
@@ -294,26 +486,36 @@ class AUVModule(mp_module.MPModule):
         self.traverse(sideways_distance/2)
         turn_direction *= -1
         self.orient_heading(turn_direction, pwm)
+        if gradient_offset != 0:
+            self.orient_heading(-gradient_offset, pwm)
+        self.command_queue.put(['phase', 'sparse'])
 
         return forward_travel_distance
 
-    def track_xy(self, pwm, direction):
-        if direction in ['x', 'y']:
-            sign = numpy.sign(pwm - 1500)
-            while self.motor_event_enabled and self.loop % 2 == 0:
-                start_time = int(time.time())
-                self.xy[direction] += sign
-                self.sample(channel)
-                time.sleep(1 - (int(time.time()) - start_time) % 1)
-            else:
-                self.xy['x'] = len(self.pollution_array)
-            if direction == 'y':
-                sign *= -1
-            while self.motor_event_enabled and self.loop % 2 == 1:
-                start_time = int(time.time())
-                self.xy[direction] -= sign
-                self.sample(channel)
-                time.sleep(1 - (int(time.time()) - start_time) % 1)
+    def dense_side(self, heading, distance):
+        '''1 to start the dense pass to the left of HEADING, -1 to the right, where less oxygen is estimated DISTANCE away'''
+        h = numpy.radians(heading)
+        x = self.xy['x'] + distance * numpy.array([-numpy.cos(h), numpy.cos(h)])
+        y = self.xy['y'] + distance * numpy.array([numpy.sin(h), -numpy.sin(h)])
+        if not (self.field_estimate.weight(x, y) > 0).all():
+            return 1  # no samples reach one side, keep to the left
+        mean = self.field_estimate.estimate(x, y)[0]
+        return 1 if mean[0] <= mean[1] else -1
+
+    def gradient_offset(self):
+        '''degrees to turn (positive ccw, as orient_heading) to face up the pollution gradient, 0 if unknown'''
+        bearing = self.gradient_estimate.bearing()
+        if bearing is None:
+            return 0
+        clockwise = (bearing - self.current_heading() + 180) % 360 - 180
+        return -clockwise
+
+    def update_xy(self):
+        '''publish the dead reckoning estimate'''
+        x, y, depth, std = self.dead_reckoning.position()
+        self.xy['x'] = x
+        self.xy['y'] = y
+        self.xy_std = std
 
     # args = [direction, pwm, seconds]
     # roll - 3
@@ -328,13 +530,13 @@ class AUVModule(mp_module.MPModule):
             print("forward")
             self.rc_manager.override[4] = int(args[1])
             self.rc_manager.send_rc_override()
-            # self.track_xy(int(args[1]), 'y')
+            self.dead_reckoning.set_thrust('f', int(args[1]))
             return
         elif args[0] == "l":
             # This is how the joystick module does it
             self.rc_manager.override[5] = int(args[1])
             self.rc_manager.send_rc_override()
-            # self.track_xy(int(args[1]), 'y')
+            self.dead_reckoning.set_thrust('l', int(args[1]))
             return
         elif args[0] == "z":
             self.rc_manager.override[1] = int(args[1])
@@ -355,6 +557,11 @@ class AUVModule(mp_module.MPModule):
     def stop_motor(self):
         args = ["all", "1500"]
         self.rc_manager.cmd_rc(args)
+        self.dead_reckoning.set_thrust('all', 1500)
+        if self.depth_control.active:
+            # keep holding depth between segments
+            self.rc_manager.override[1] = self.depth_control.pwm
+            self.rc_manager.send_rc_override()
         return
 
     def psensor_update(self, SCALED_PRESSURE3):
@@ -368,6 +575,8 @@ class AUVModule(mp_module.MPModule):
         self.depth_sensor[0] = SCALED_PRESSURE.press_abs
         self.depth_sensor[1] = SCALED_PRESSURE.press_diff
         self.depth_sensor[2] = SCALED_PRESSURE.temperature
+        self.nav.pressure(SCALED_PRESSURE, SCALED_PRESSURE._timestamp)  # a no-op if the nav module got there first
+        self.dead_reckoning.set_depth(self.depth_gauge.depth, SCALED_PRESSURE._timestamp)
 
     def gps_update(self, GLOBAL_POSITION_INT):
         '''update gps readings'''
@@ -379,13 +588,72 @@ class AUVModule(mp_module.MPModule):
         self.vy = GLOBAL_POSITION_INT.vy
         self.vz = GLOBAL_POSITION_INT.vz
         self.hdg = GLOBAL_POSITION_INT.hdg
+        t = GLOBAL_POSITION_INT._timestamp
+        if self.hdg != 65535:
+            self.dead_reckoning.set_heading(self.hdg / 100.0, t)
+        if self.vx != 0 or self.vy != 0:
+            self.dead_reckoning.set_velocity(self.vx / 100.0, self.vy / 100.0, t)
+        self.nav.position(GLOBAL_POSITION_INT, t)
+
+    def gps_fix(self, GPS_RAW_INT):
+        '''reset the dead reckoning to a 3D fix, which only happens at the surface; the first one georeferences the map'''
+        if GPS_RAW_INT.fix_type < 3:
+            return
+        if self.pollution_map.origin == (0.0, 0.0):
+            self.pollution_map.set_origin(GPS_RAW_INT.lat * 1.0e-7, GPS_RAW_INT.lon * 1.0e-7)
+        x, y = mp_deadreckon.local_xy(GPS_RAW_INT.lat * 1.0e-7, GPS_RAW_INT.lon * 1.0e-7, self.pollution_map.origin)
+        accuracy = 5.0 if GPS_RAW_INT.eph == 65535 else GPS_RAW_INT.eph * 0.025  # 2.5m per unit HDOP
+        self.dead_reckoning.fix(x, y, accuracy, GPS_RAW_INT._timestamp)
+
+    def attitude_update(self, ATTITUDE):
+        '''heading for the dead reckoning, at the attitude rate'''
+        self.yaw = numpy.degrees(ATTITUDE.yaw) % 360
+        self.dead_reckoning.set_heading(self.yaw, ATTITUDE._timestamp)
+        self.nav.attitude(ATTITUDE, ATTITUDE._timestamp)
+
+    def nav_update(self, state):
+        '''run the heading and depth loops on each fused nav state, letting go of any whose input went stale'''
+        if self.heading_control.active:
+            if state.heading_valid:
+                self.heading_update(state.heading, state.yawspeed)
+            else:
+                self.heading_control.stop(time.time())
+                print("no heading for %.1fs, turn abandoned" % self.nav.stale_timeout)
+                self.rc_manager.override[3] = 1500
+                self.rc_manager.send_rc_override()
+                self.end_time = time.time()
+        if self.depth_control.active:
+            if state.depth_valid:
+                self.depth_update(state.depth)
+            else:
+                self.depth_control.release()
+                print("no depth for %.1fs, depth hold released" % self.nav.stale_timeout)
+                self.rc_manager.override[1] = 1500
+                self.rc_manager.send_rc_override()
+                if self.depth_command:
+                    self.depth_command = False
+                    self.end_time = time.time()
+
+    def unload(self):
+        '''stop following the shared nav state'''
+        self.nav.topic.unsubscribe(self.nav_update)
 
     def battery_update(self, SYS_STATUS):
         '''update battery level'''
         # main flight battery
-        # self.battery_level = SYS_STATUS.battery_remaining
+        self.battery_level = SYS_STATUS.battery_remaining
         self.voltage_level = SYS_STATUS.voltage_battery
         self.current_battery = SYS_STATUS.current_battery
+        if SYS_STATUS.current_battery != -1:
+            # cA x mV
+            self.energy.update(SYS_STATUS.current_battery * SYS_STATUS.voltage_battery * 1.0e-5, SYS_STATUS._timestamp, 'SYS_STATUS')
+
+    def battery_status_update(self, BATTERY_STATUS):
+        '''the same power from BATTERY_STATUS, used when SYS_STATUS does not carry it'''
+        if BATTERY_STATUS.current_battery == -1:
+            return
+        millivolts = sum(v for v in BATTERY_STATUS.voltages if v != 65535)
+        self.energy.update(BATTERY_STATUS.current_battery * millivolts * 1.0e-5, BATTERY_STATUS._timestamp, 'BATTERY_STATUS')
 
     def idle_task(self):
         '''time motor events, track battery usage, and time sensor readings'''
@@ -399,24 +667,54 @@ class AUVModule(mp_module.MPModule):
                 if self.rc_manager.override_counter > 0:
                     self.rc_manager.override_counter -= 1
         if self.end_time <= time.time():
+            if self.heading_control.active:
+                self.heading_control.stop(time.time())
+                print("turn to %.0f timed out" % self.heading_control.report['target'])
+            if self.depth_command:
+                self.depth_command = False
+                print("depth %.2fm not reached, still holding" % self.depth_control.target)
             self.stop_motor()
-            with open("/home/pi/motor_battery.txt", "a+") as f:
-                f.write("uJoules: %s, Run time: %s, Time: " % (self.ujoules, self.motor_run_time) + time.strftime("%H:%M:%S") + "\n")
-            self.joules = 0
-            if self.command_queue.empty() is False:
-                command = self.command_queue.get()
-                self.cmd_move([str(command[0]), command[1]])
-                self.end_time = time.time() + command[2]
-                self.motor_run_time = command[2]
+            run_time = self.energy.segment_seconds or self.motor_run_time
+            with open(os.path.join(DATA_DIR, "motor_battery.txt"), "a+") as f:
+                f.write("Joules: %.3f, Run time: %.3f, Axis: %s, PWM: %s, Phase: %s, Time: " % (self.energy.segment_joules, run_time, self.motor_axis, self.motor_pwm, self.phase) + time.strftime("%H:%M:%S") + "\n")
+            command = self.next_command()
+            if command is not None:
+                if command[0] in ['turn', 'heading']:
+                    self.start_turn(command)
+                elif command[0] == 'depth':
+                    self.depth_control.start(command[1], time.time())
+                    self.depth_command = True
+                    self.end_time = time.time() + command[2]
+                    self.motor_axis = 'z'
+                    self.motor_pwm = 1400 if command[1] > self.depth_gauge.depth else 1600
+                else:
+                    self.cmd_move([str(command[0]), command[1]])
+                    self.end_time = time.time() + command[2]
+                    self.motor_run_time = command[2]
+                    self.motor_axis = str(command[0])
+                    self.motor_pwm = command[1]
             else:
                 self.end_time = time.time() + 1
-        elif now - self.last_batt >= 1:
-            self.last_batt = now
-            self.ujoules += self.batt_info()
+                self.motor_run_time = 1
+                self.motor_axis = 'idle'
+                self.motor_pwm = 1500
+                self.phase = 'idle'
+            self.energy.start_segment(self.motor_axis, self.phase)
         if now - self.last_sample > 1:
             self.last_sample = now
             self.sample()
 
+    def next_command(self):
+        '''the next motor command, applying the phase markers ahead of it'''
+        while self.command_queue.empty() is False:
+            command = self.command_queue.get()
+            if command[0] != 'phase':
+                if self.phase == 'idle':
+                    self.phase = 'transit'
+                return command
+            self.phase = command[1]
+        return None
+
     def mavlink_packet(self, m):
         '''handle mavlink packets'''
         mtype = m.get_type()
@@ -424,15 +722,30 @@ class AUVModule(mp_module.MPModule):
             if self.settings.target_system == 0 or self.settings.target_system == m.get_srcSystem():
                 self.gps_update(m)
 
+        if mtype == 'GPS_RAW_INT':
+            self.gps_fix(m)
+
+        if mtype == 'ATTITUDE':
+            self.attitude_update(m)
+
+        if mtype == 'VFR_HUD':
+            self.nav.hud(m, m._timestamp)
+
         if mtype == 'SCALED_PRESSURE3':
             self.psensor_update(m)
 
         if mtype == 'SCALED_PRESSURE':
             self.dsensor_update(m)
 
+        if mtype in ['GLOBAL_POSITION_INT', 'GPS_RAW_INT', 'ATTITUDE', 'SCALED_PRESSURE']:
+            self.update_xy()
+
         if mtype == "SYS_STATUS":
             self.battery_update(m)
 
+        if mtype == "BATTERY_STATUS":
+            self.battery_status_update(m)
+
         if mtype in ['WAYPOINT_COUNT', 'MISSION_COUNT']:
             if self.wp_op is None:
                 self.console.error("No waypoint load started")
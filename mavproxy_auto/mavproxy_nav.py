@@ -12,59 +12,79 @@ import numpy
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules import mp_navstate
 
 
 class NavigationModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(NavigationModule, self).__init__(mpstate, "nav", "Update attitude", public=True)
 
-        '''Attitude'''
-        self.lat = 0
-        self.lon = 0
-        self.alt = 0
-        self.relative_alt = 0
-        self.vx = 0
-        self.vy = 1
-        self.vz = 1
-        self.hdg = 0
+        '''Latest snapshot of each navigation message, published on change'''
+        self.topics = {'GLOBAL_POSITION_INT': mp_navstate.Topic(mp_navstate.Position),
+                       'ATTITUDE': mp_navstate.Topic(mp_navstate.Attitude),
+                       'VFR_HUD': mp_navstate.Topic(mp_navstate.Hud)}
+        self.fusion = mp_navstate.fusion(10)  # attitude, speed and depth in one state, shared with the auto module
+        self.topics['NAV'] = self.fusion.topic
+        self.depth_gauge = self.fusion.gauge
+        self.publishing = True
 
-        self.add_command('nav', self.cmd_nav, 'Start nav daemon', ['<start|stop>'])
+        self.add_command('nav', self.cmd_nav, 'Navigation state', ['<start|stop|status|rate>'])
 
     def cmd_nav(self, args):
-        if len(args) != 1:
-            return "Usage: nav <start|stop>"
+        if len(args) == 2 and args[0] == 'rate':
+            self.fusion.rate = float(args[1])
+        elif len(args) != 1:
+            return "Usage: nav <start|stop|status|rate hz>"
         elif args[0] == 'start':
-            self.idle_task()
+            self.publishing = True
         elif args[0] == 'stop':
-            sleep(120)
+            self.publishing = False
+        elif args[0] == 'status':
+            for mtype in sorted(self.topics.keys()):
+                print(self.topics[mtype].latest)
         else:
-            return "Usage: nav <start|stop>"
+            return "Usage: nav <start|stop|status|rate hz>"
 
-    '''Public function for use by other modules to grab real time attitude information'''
-    def get_attitude(self):
-        return [self.lat, self.lon, self.alt, self.relative_alt, self.vx, self.vy, self.vz, self.hdg]
+    '''Public functions for use by other modules'''
+    def subscribe(self, mtype, callback):
+        '''call CALLBACK(snapshot) whenever a MTYPE message changes the state'''
+        return self.topics[mtype].subscribe(callback)
+
+    def unsubscribe(self, mtype, callback):
+        self.topics[mtype].unsubscribe(callback)
 
-    def gps_update(self, GLOBAL_POSITION_INT):
-        '''update gps readings'''
-        self.lat = GLOBAL_POSITION_INT.lat
-        self.lon = GLOBAL_POSITION_INT.lon
-        self.alt = GLOBAL_POSITION_INT.alt
-        self.relative_alt = GLOBAL_POSITION_INT.relative_alt
-        self.vx = GLOBAL_POSITION_INT.vx
-        self.vy = GLOBAL_POSITION_INT.vy
-        self.vz = GLOBAL_POSITION_INT.vz
-        self.hdg = GLOBAL_POSITION_INT.hdg
+    def wait(self, mtype, version=0, timeout=None):
+        '''block until there is a MTYPE snapshot newer than VERSION'''
+        return self.topics[mtype].wait(version, timeout)
 
-    '''sleep'''
-    def idle_task(self):
-        # wait for mavlink packets
-        print self.hdg/100
+    def latest(self, mtype):
+        '''the current MTYPE snapshot, None before the first message'''
+        return self.topics[mtype].latest
+
+    def get_attitude(self):
+        '''the latest GLOBAL_POSITION_INT snapshot: lat, lon, alt, relative_alt, vx, vy, vz, hdg'''
+        return self.topics['GLOBAL_POSITION_INT'].latest
 
     def mavlink_packet(self, m):
+        if not self.publishing:
+            return
         mtype = m.get_type()
+        t = getattr(m, '_timestamp', time.time())
+        if mtype == 'SCALED_PRESSURE':
+            self.fusion.pressure(m, t)
+            return
+        topic = self.topics.get(mtype)
+        if topic is None:
+            return
         if mtype == 'GLOBAL_POSITION_INT':
-            if self.settings.target_system == 0 or self.settings.target_system == m.get_srcSystem():
-             self.gps_update(m)
+            if self.settings.target_system != 0 and self.settings.target_system != m.get_srcSystem():
+                return
+            self.fusion.position(m, t)
+        elif mtype == 'ATTITUDE':
+            self.fusion.attitude(m, t)
+        elif mtype == 'VFR_HUD':
+            self.fusion.hud(m, t)
+        topic.publish(m, t)
 
 
 def init(mpstate):
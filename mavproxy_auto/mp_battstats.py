@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+'''rolling battery statistics over fixed time windows'''
+
+import numpy
+
+CHANNELS = ['voltage', 'current', 'power']
+
+
+class Window():
+    '''
+    min/mean/max of each channel over the last SECONDS, kept in BUCKETS
+    equal time slices so memory is fixed however fast samples arrive. The
+    window slides a bucket at a time. SECONDS of None never expires, for
+    whole mission figures.
+    '''
+    def __init__(self, seconds, buckets=10):
+        self.seconds = seconds
+        if seconds is None:
+            buckets = 1
+        self.width = None if seconds is None else float(seconds) / buckets
+        self.count = numpy.zeros(buckets, int)
+        self.sum = numpy.zeros([buckets, len(CHANNELS)])
+        self.min = numpy.zeros([buckets, len(CHANNELS)])
+        self.max = numpy.zeros([buckets, len(CHANNELS)])
+        self.reset()
+
+    def reset(self):
+        self.count[:] = 0
+        self.sum[:] = 0
+        self.min[:] = numpy.inf
+        self.max[:] = -numpy.inf
+        self.newest = None  # absolute number of the newest bucket
+
+    def add(self, t, values):
+        '''one sample of CHANNELS at time T'''
+        n = len(self.count)
+        b = 0 if self.width is None else int(t // self.width)
+        if self.newest is None or b > self.newest:
+            # clear the buckets the window slid past
+            first = b - n + 1 if self.newest is None else max(self.newest + 1, b - n + 1)
+            for k in range(first, b + 1):
+                i = k % n
+                self.count[i] = 0
+                self.sum[i] = 0
+                self.min[i] = numpy.inf
+                self.max[i] = -numpy.inf
+            self.newest = b
+        elif b <= self.newest - n:
+            return  # older than the window
+        i = b % n
+        self.count[i] += 1
+        self.sum[i] += values
+        numpy.minimum(self.min[i], values, out=self.min[i])
+        numpy.maximum(self.max[i], values, out=self.max[i])
+
+    def stats(self):
+        '''{channel: (min, mean, max)}, empty without samples'''
+        count = self.count.sum()
+        if count == 0:
+            return {}
+        mean = self.sum.sum(axis=0) / count
+        lo = self.min.min(axis=0)
+        hi = self.max.max(axis=0)
+        return dict((c, (lo[k], mean[k], hi[k])) for k, c in enumerate(CHANNELS))
+
+
+class Threshold():
+    '''
+    watches one statistic of one window and reports only when it crosses
+    LEVEL, with HYSTERESIS before the opposite crossing is reported
+    '''
+    def __init__(self, name, window, channel, stat, level, below=True, hysteresis=0.0):
+        self.name = name
+        self.window = window
+        self.channel = CHANNELS.index(channel)
+        self.stat = ('min', 'mean', 'max').index(stat)
+        self.level = level
+        self.below = below
+        self.hysteresis = hysteresis
+        self.crossed = False
+
+    def check(self, stats):
+        '''True on a crossing into the alarm side, False out of it, None otherwise'''
+        if not stats:
+            return None
+        value = stats[CHANNELS[self.channel]][self.stat]
+        sign = 1 if self.below else -1
+        if not self.crossed and sign * (self.level - value) > 0:
+            self.crossed = True
+            return True
+        if self.crossed and sign * (value - self.level) > self.hysteresis:
+            self.crossed = False
+            return False
+        return None
+
+
+class BatteryStats():
+    '''the 10 second, one minute and mission windows plus their thresholds'''
+    def __init__(self):
+        self.windows = {'10s': Window(10, 10), '1min': Window(60, 12), 'mission': Window(None)}
+        self.thresholds = []
+        self.values = numpy.zeros(len(CHANNELS))
+
+    def add(self, t, volts, amps):
+        '''one reading; returns the thresholds that crossed as (name, crossed) pairs'''
+        self.values[0] = volts
+        self.values[1] = amps
+        self.values[2] = volts * amps
+        for w in self.windows.values():
+            w.add(t, self.values)
+        if not self.thresholds:
+            return []
+        events = []
+        cache = {}
+        for th in self.thresholds:
+            if th.window not in cache:
+                cache[th.window] = self.windows[th.window].stats()
+            crossed = th.check(cache[th.window])
+            if crossed is not None:
+                events.append((th.name, crossed))
+        return events
+
+    def reset_mission(self):
+        self.windows['mission'].reset()
+
+    def report(self):
+        '''console lines for every window'''
+        lines = []
+        for name in ['10s', '1min', 'mission']:
+            s = self.windows[name].stats()
+            if not s:
+                continue
+            lines.append("%-7s %5.2f/%5.2f/%5.2fV %5.1f/%5.1f/%5.1fA %6.1f/%6.1f/%6.1fW" % (
+                (name,) + s['voltage'] + s['current'] + s['power']))
+        return lines
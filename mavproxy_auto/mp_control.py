@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+'''closed loop control of the thrust channels from telemetry'''
+
+
+def wrap180(degrees):
+    '''angle in -180..180'''
+    return (degrees + 180.0) % 360.0 - 180.0
+
+
+class HeadingController():
+    '''
+    PID on the heading error, fed from ATTITUDE at message rate.
+    The output is a yaw pwm, positive clockwise, clamped to LIMIT us either
+    side of neutral. Outputs below MIN_OUTPUT are raised to it so the
+    thrusters get past their deadband. The integrator only runs while the
+    output is not saturated. A turn ends once the error has stayed inside
+    TOLERANCE degrees and the yaw rate inside RATE_TOLERANCE deg/s for
+    SETTLE seconds, or after TIMEOUT seconds.
+    '''
+    def __init__(self, kp=3.0, ki=0.2, kd=1.5, limit=100, min_output=25,
+                 tolerance=3.0, rate_tolerance=5.0, settle=0.5, timeout=20.0):
+        self.kp = kp  # us per degree
+        self.ki = ki  # us per degree second
+        self.kd = kd  # us per deg/s
+        self.limit = limit
+        self.min_output = min_output
+        self.tolerance = tolerance
+        self.rate_tolerance = rate_tolerance
+        self.settle = settle
+        self.timeout = timeout
+        self.active = False
+        self.report = None
+
+    def start(self, target, heading, t, limit=None):
+        '''turn to TARGET compass degrees from HEADING at time T'''
+        self.target = target % 360.0
+        self.start_time = t
+        self.last_time = t
+        self.inside_since = None
+        self.integral = 0.0
+        self.initial_error = wrap180(self.target - heading)
+        self.overshoot = 0.0
+        self.output_limit = self.limit if limit is None else limit
+        self.active = True
+        self.report = None
+
+    def stop(self, t, error=None):
+        '''end the turn, filling in report with its time, overshoot and final error'''
+        if self.active:
+            self.report = {'target': self.target, 'time': t - self.start_time,
+                           'turn': abs(self.initial_error), 'overshoot': self.overshoot,
+                           'error': error, 'settled': self.inside_since is not None}
+        self.active = False
+
+    def update(self, heading, rate, t):
+        '''yaw pwm for HEADING (deg) and RATE (deg/s, clockwise) at time T, None once done'''
+        if not self.active:
+            return None
+        error = wrap180(self.target - heading)
+        dt = max(t - self.last_time, 0.0)
+        self.last_time = t
+        # how far past the target the turn has carried
+        if error * self.initial_error < 0:
+            self.overshoot = max(self.overshoot, abs(error))
+        if abs(error) < self.tolerance and abs(rate) < self.rate_tolerance:
+            if self.inside_since is None:
+                self.inside_since = t
+            if t - self.inside_since >= self.settle:
+                self.stop(t, error)
+                return None
+        else:
+            self.inside_since = None
+        if t - self.start_time > self.timeout:
+            self.stop(t, error)
+            return None
+        if abs(error) < self.tolerance:
+            return 1500
+        u = self.kp * error + self.ki * self.integral - self.kd * rate
+        if abs(u) < self.output_limit:
+            self.integral += error * dt
+        else:
+            u = self.output_limit if u > 0 else -self.output_limit
+        if abs(u) < self.min_output:
+            u = self.min_output if u > 0 else -self.min_output
+        return int(round(1500 + u))
+
+
+class DepthController():
+    '''
+    PID depth hold from pressure depth at SCALED_PRESSURE rate.
+    Positive depth is down and the z channel dives below 1500, so the
+    output is 1500 minus the correction. The vertical rate is a low pass
+    filtered difference of successive depths. The hold stays on until
+    release() so it keeps working through the following segments; a target
+    of 0 releases itself on arrival. Error statistics since the depth was
+    reached are kept as running sums.
+    '''
+    def __init__(self, kp=150.0, ki=20.0, kd=100.0, limit=150, min_output=25,
+                 tolerance=0.1, rate_filter=0.3, timeout=60.0):
+        self.kp = kp  # us per metre
+        self.ki = ki  # us per metre second
+        self.kd = kd  # us per m/s
+        self.limit = limit
+        self.min_output = min_output
+        self.tolerance = tolerance
+        self.rate_filter = rate_filter
+        self.timeout = timeout  # seconds a depth command may take to arrive
+        self.active = False
+        self.pwm = 1500
+
+    def start(self, target, t):
+        '''hold TARGET metres from time T'''
+        self.target = target
+        self.start_time = t
+        self.last = None  # (time, depth)
+        self.rate = 0.0
+        self.integral = 0.0
+        self.arrived = None  # time the target was first reached
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.max_error = 0.0
+        self.active = True
+
+    def release(self):
+        self.active = False
+        self.pwm = 1500
+
+    def stats(self):
+        '''(seconds to arrive, mean, rms and max abs error while holding), None before arrival'''
+        if self.arrived is None or self.count == 0:
+            return None
+        mean = self.sum / self.count
+        return (self.arrived - self.start_time, mean, (self.sumsq / self.count) ** 0.5, self.max_error)
+
+    def update(self, depth, t):
+        '''z pwm for DEPTH metres at time T'''
+        if not self.active:
+            return 1500
+        if self.last is not None and t > self.last[0]:
+            rate = (depth - self.last[1]) / (t - self.last[0])
+            self.rate += self.rate_filter * (rate - self.rate)
+        dt = t - self.last[0] if self.last is not None else 0.0
+        self.last = (t, depth)
+        error = self.target - depth
+        if self.arrived is None and abs(error) < self.tolerance:
+            self.arrived = t
+        if self.arrived is not None:
+            self.count += 1
+            self.sum += error
+            self.sumsq += error * error
+            self.max_error = max(self.max_error, abs(error))
+        if self.target <= 0 and self.arrived is not None:
+            self.release()
+            return 1500
+        u = self.kp * error + self.ki * self.integral - self.kd * self.rate
+        if abs(u) < self.limit:
+            self.integral += error * dt
+        else:
+            u = self.limit if u > 0 else -self.limit
+        if abs(error) < self.tolerance and abs(u) < self.min_output:
+            u = 0.0
+        elif abs(u) < self.min_output:
+            u = self.min_output if u > 0 else -self.min_output
+        self.pwm = int(round(1500 - u))
+        return self.pwm
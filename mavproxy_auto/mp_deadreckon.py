@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+'''dead reckoning of the local position while submerged'''
+
+import math
+
+from MAVProxy.modules import mp_plan
+
+'''metres per degree of latitude'''
+METRES_PER_DEGREE = 111319.5
+
+
+def local_xy(lat, lon, origin):
+    '''x (east), y (north) metres of LAT, LON degrees from the ORIGIN (lat, lon)'''
+    x = (lon - origin[1]) * METRES_PER_DEGREE * math.cos(math.radians(origin[0]))
+    y = (lat - origin[0]) * METRES_PER_DEGREE
+    return x, y
+
+
+class DeadReckoner():
+    '''
+    Integrates heading and velocity at message rate to track x (east),
+    y (north) metres from the map origin, resetting to every GPS fix.
+    Velocity comes from telemetry when the autopilot supplies it, otherwise
+    from the commanded thrust through MODEL. The uncertainty is the fix
+    accuracy plus a fraction of the distance travelled since (heading and
+    speed error) plus an unknown current acting over the elapsed time.
+    '''
+    def __init__(self, model=None, commanded_error=0.2, measured_error=0.05,
+                 current=0.05, velocity_timeout=2.0):
+        self.model = model or mp_plan.MotionModel()
+        self.commanded_error = commanded_error  # fraction of distance, thrust based
+        self.measured_error = measured_error  # fraction of distance, telemetry based
+        self.current = current  # m/s of unmodelled drift
+        self.velocity_timeout = velocity_timeout
+        self.x = 0.0
+        self.y = 0.0
+        self.depth = 0.0
+        self.heading = 0.0  # radians clockwise from north
+        self.thrust = {'f': 1500, 'l': 1500}
+        self.measured = None  # (north, east) m/s from telemetry
+        self.measured_time = 0
+        self.t = None  # time of the last update
+        self.fix_time = None
+        self.fix_std = 0.0
+        self.error = 0.0  # metres of distance-proportional error since the fix
+
+    def advance(self, t):
+        '''integrate up to time T with the velocity held since the last update'''
+        if self.t is None:
+            self.t = t
+            return
+        dt = t - self.t
+        if dt <= 0:
+            return
+        self.t = t
+        if self.measured is not None and t - self.measured_time < self.velocity_timeout:
+            vn, ve = self.measured
+            fraction = self.measured_error
+        else:
+            forward = self.model.distance('f', self.thrust['f'], 1.0) * (1 if self.thrust['f'] >= 1500 else -1)
+            lateral = self.model.distance('l', self.thrust['l'], 1.0) * (1 if self.thrust['l'] >= 1500 else -1)
+            s, c = math.sin(self.heading), math.cos(self.heading)
+            vn = forward * c - lateral * s
+            ve = forward * s + lateral * c
+            fraction = self.commanded_error
+        self.x += ve * dt
+        self.y += vn * dt
+        self.error += fraction * math.hypot(vn, ve) * dt
+
+    def set_heading(self, degrees, t):
+        self.advance(t)
+        self.heading = math.radians(degrees)
+
+    def set_thrust(self, axis, pwm):
+        '''commanded pwm of the f or l channel, from the last update on'''
+        if axis in self.thrust:
+            self.thrust[axis] = pwm
+        elif axis == 'all':
+            self.thrust['f'] = self.thrust['l'] = pwm
+
+    def set_velocity(self, north, east, t):
+        '''ground velocity in m/s from telemetry'''
+        self.advance(t)
+        self.measured = (north, east)
+        self.measured_time = t
+
+    def set_depth(self, depth, t):
+        self.advance(t)
+        self.depth = depth
+
+    def fix(self, x, y, accuracy, t):
+        '''reset to a position fix of ACCURACY metres'''
+        self.advance(t)
+        self.x = x
+        self.y = y
+        self.fix_std = accuracy
+        self.fix_time = t
+        self.error = 0.0
+
+    def std(self):
+        '''one sigma horizontal uncertainty in metres, None before the first fix'''
+        if self.fix_time is None:
+            return None
+        return self.fix_std + self.error + self.current * (self.t - self.fix_time)
+
+    def position(self):
+        '''(x, y, depth, std)'''
+        return self.x, self.y, self.depth, self.std()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+'''streaming change-point detection on sensor readings'''
+
+import math
+
+
+class ChangeDetector():
+    '''
+    EWMA baseline plus a one-sided CUSUM on the standardised residual.
+    DIRECTION is +1 to watch for rises, -1 for drops (e.g. dissolved oxygen).
+    While the channel is at baseline the CUSUM builds evidence of a shift and
+    fires a 'trigger' once it passes THRESHOLD; while triggered a second CUSUM
+    builds evidence of a return and fires 'clear'. The baseline is frozen
+    while triggered so a plume is not absorbed into it.
+    State is a handful of floats, so update() is O(1).
+    '''
+    def __init__(self, direction=1, alpha=0.05, slack=0.5, threshold=5.0,
+                 warmup=10, min_std=1e-3):
+        self.direction = direction
+        self.alpha = alpha
+        self.slack = slack  # shift in standard deviations ignored by the CUSUM
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.cusum = 0.0
+        self.triggered = False
+
+    def confidence(self):
+        '''0..1 strength of the evidence behind the current state'''
+        return 1.0 - math.exp(-self.cusum / self.threshold)
+
+    def score(self, value):
+        '''standard deviations VALUE is from the baseline, in the watched direction'''
+        return self.direction * (value - self.mean) / max(math.sqrt(self.var), self.min_std)
+
+    def update(self, value):
+        '''feed one reading, returning ('trigger'|'clear', confidence) or None'''
+        self.count += 1
+        if self.count <= self.warmup:
+            # plain running mean and variance until the EWMA has something to start from
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.var += (delta * (value - self.mean) - self.var) / self.count
+            return None
+
+        z = self.score(value)
+        if not self.triggered:
+            self.cusum = max(0.0, self.cusum + z - self.slack)
+            if self.cusum > self.threshold:
+                event = ('trigger', self.confidence())
+                self.triggered = True
+                self.cusum = 0.0
+                return event
+            # only learn the baseline from in-control readings
+            delta = value - self.mean
+            self.mean += self.alpha * delta
+            self.var = (1 - self.alpha) * (self.var + self.alpha * delta * delta)
+        else:
+            self.cusum = max(0.0, self.cusum + self.slack - z)
+            if self.cusum > self.threshold:
+                event = ('clear', self.confidence())
+                self.triggered = False
+                self.cusum = 0.0
+                return event
+        return None
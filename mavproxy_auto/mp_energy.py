@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+'''
+energy per maneuver fitted from motor_battery.txt
+
+    python mp_energy.py /home/pi/motor_battery.txt /home/pi/energy_model.json
+'''
+
+import json
+import os
+import re
+import sys
+import numpy
+
+from MAVProxy.modules import mp_plan
+
+'''older logs give uJoules: SYS_STATUS current (cA) x voltage (mV) summed once a second'''
+LOG_UNITS_TO_JOULES = 1.0e-5
+
+'''14.8V 18Ah BlueROV2 battery'''
+BATTERY_JOULES = 14.8 * 18 * 3600
+
+MODEL_FILE = '/home/pi/energy_model.json'
+
+LOG_LINE = re.compile(r'(u?)Joules: ([-\d.e+]+), Run time: ([-\d.e+]+), Axis: (\w+), PWM: (\d+)')
+
+RECORD_DTYPE = numpy.dtype([('axis', 'S4'), ('pwm', '<u2'), ('seconds', '<f8'), ('joules', '<f8')])
+
+
+def parse_motor_log(filename):
+    '''one record per logged motor segment; lines without axis and pwm are skipped'''
+    records = []
+    with open(filename) as f:
+        for line in f:
+            m = LOG_LINE.search(line)
+            if m is None:
+                continue
+            seconds = float(m.group(3))
+            if seconds <= 0:
+                continue
+            joules = float(m.group(2))
+            if m.group(1):
+                joules *= LOG_UNITS_TO_JOULES
+            records.append((m.group(4), int(m.group(5)), seconds, joules))
+    return numpy.array(records, RECORD_DTYPE)
+
+
+def fit(records):
+    '''
+    least squares fit of power = c0 + c1*d + c2*d^2 for every axis, d being
+    the pwm deflection from neutral as a fraction of 400us. Segments are
+    weighted by their duration. Idle segments give the hotel load.
+    '''
+    params = {'hotel': None, 'axes': {}}
+    for axis in numpy.unique(records['axis']):
+        sel = records[records['axis'] == axis]
+        name = axis.decode('ascii') if isinstance(axis, bytes) else axis
+        power = sel['joules'] / sel['seconds']
+        w = numpy.sqrt(sel['seconds'])
+        if name == 'idle':
+            params['hotel'] = float(numpy.average(power, weights=sel['seconds']))
+            continue
+        d = numpy.abs(sel['pwm'].astype(float) - 1500) / 400.0
+        X = numpy.stack([numpy.ones(len(d)), d, d * d], axis=1)
+        coef = numpy.linalg.lstsq(X * w[:, None], power * w, rcond=None)[0]
+        residual = power - X.dot(coef)
+        params['axes'][name] = {'coef': [float(c) for c in coef], 'segments': int(len(sel)),
+                                'rms': float(numpy.sqrt(numpy.mean(residual ** 2)))}
+    return params
+
+
+class EnergyModel(mp_plan.MotionModel):
+    '''MotionModel whose energy comes from fitted per-axis power curves'''
+    def __init__(self, params=None, **kwargs):
+        mp_plan.MotionModel.__init__(self, **kwargs)
+        self.coef = {}
+        if params is not None:
+            if params.get('hotel') is not None:
+                self.hotel = params['hotel']
+            for axis, p in params['axes'].items():
+                self.coef[axis] = tuple(p['coef'])
+
+    def energy(self, axis, pwm, seconds):
+        '''joules for one maneuver'''
+        c = self.coef.get(axis)
+        if c is None:
+            return mp_plan.MotionModel.energy(self, axis, pwm, seconds)
+        d = abs(pwm - 1500) / 400.0
+        return (c[0] + d * (c[1] + d * c[2])) * seconds
+
+    def plan_energy(self, plan):
+        '''joules for a compiled mp_plan schedule'''
+        return sum(self.energy(a, int(p), float(s)) for a, p, s in zip(plan['axis'].astype(str), plan['pwm'], plan['seconds']))
+
+
+class EnergyAccountant():
+    '''
+    Trapezoidal integration of battery power on every SYS_STATUS or
+    BATTERY_STATUS, using the message timestamps. Energy goes to the current
+    motor segment, its axis and its mission phase. Only one message type is
+    integrated at a time, the other takes over if it goes quiet for STALE
+    seconds. Totals are plain floats updated in place.
+    '''
+    def __init__(self, phases=mp_plan.PHASES, axes=('f', 'l', 'z', 'yaw', 'roll', 'idle'), stale=5.0):
+        self.phases = list(phases)
+        self.phase_index = dict((p, i) for i, p in enumerate(self.phases))
+        self.axes = list(axes)
+        self.axis_index = dict((a, i) for i, a in enumerate(self.axes))
+        self.stale = stale
+        self.phase_joules = [0.0] * len(self.phases)
+        self.axis_joules = [0.0] * len(self.axes)
+        self.total = 0.0
+        self.seconds = 0.0
+        self.source = None
+        self.last_time = None
+        self.last_watts = 0.0
+        self.start_segment('idle', 'idle')
+
+    def start_segment(self, axis, phase):
+        '''attribute energy to AXIS and PHASE from now on'''
+        self.axis = self.axis_index.get(axis, self.axis_index['idle'])
+        self.phase = self.phase_index.get(phase, self.phase_index['idle'])
+        self.segment_joules = 0.0
+        self.segment_seconds = 0.0
+
+    def update(self, watts, t, source):
+        '''one power reading of WATTS at time T from message type SOURCE'''
+        if source != self.source:
+            if self.source is not None and t - self.last_time < self.stale:
+                return
+            # first reading or a new source: start integrating from here
+            self.source = source
+            self.last_time = t
+            self.last_watts = watts
+            return
+        dt = t - self.last_time
+        if dt <= 0:
+            return
+        joules = 0.5 * (watts + self.last_watts) * dt
+        self.last_time = t
+        self.last_watts = watts
+        self.segment_joules += joules
+        self.segment_seconds += dt
+        self.phase_joules[self.phase] += joules
+        self.axis_joules[self.axis] += joules
+        self.total += joules
+        self.seconds += dt
+
+    def watts(self):
+        '''mean power so far'''
+        if self.seconds <= 0:
+            return 0.0
+        return self.total / self.seconds
+
+    def report(self):
+        '''{phase or axis: joules} for the nonzero totals'''
+        out = dict((p, j) for p, j in zip(self.phases, self.phase_joules) if j)
+        out.update(('axis ' + a, j) for a, j in zip(self.axes, self.axis_joules) if j)
+        return out
+
+
+def load_model(filename=MODEL_FILE):
+    '''the fitted model, or the default MotionModel figures if none has been fitted'''
+    if not os.path.exists(filename):
+        return EnergyModel()
+    with open(filename) as f:
+        return EnergyModel(json.load(f))
+
+
+def save_model(params, filename=MODEL_FILE):
+    with open(filename, 'w') as f:
+        json.dump(params, f, indent=1, sort_keys=True)
+
+
+def feasible(joules, battery_percent, margin=1.25):
+    '''True if JOULES with a safety MARGIN fit in the remaining charge'''
+    return joules * margin < battery_percent / 100.0 * BATTERY_JOULES
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: mp_energy.py motor_battery.txt energy_model.json")
+        sys.exit(1)
+    records = parse_motor_log(sys.argv[1])
+    params = fit(records)
+    save_model(params, sys.argv[2])
+    if params['hotel'] is not None:
+        print("hotel %.1fW" % params['hotel'])
+    for axis, p in sorted(params['axes'].items()):
+        print("%-4s %3u segments  P = %.1f + %.1f d + %.1f d^2 W  (rms %.1fW)" % (
+            axis, p['segments'], p['coef'][0], p['coef'][1], p['coef'][2], p['rms']))
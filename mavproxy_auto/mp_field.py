@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+'''online interpolation of the pollution field from point samples'''
+
+import numpy
+
+from MAVProxy.modules import mp_pollution
+
+'''per-node kernel sums: total weight, weighted value and weighted square'''
+ACCUM_DTYPE = numpy.dtype([('w', '<f8'), ('wv', '<f8'), ('wvv', '<f8')])
+
+
+class KernelGrid(mp_pollution.PollutionMap):
+    '''sparse tiled grid of kernel sums, one node per map cell'''
+    cell_dtype = ACCUM_DTYPE
+
+
+class FieldEstimator():
+    '''
+    Gaussian kernel regression of the pollution field.
+    Every sample adds its kernel weight to the grid nodes within RADIUS
+    (3 length scales by default), so a new sample only touches its own
+    neighbourhood and estimate() is a lookup of the node sums.
+    Uncertainty shrinks with the kernel weight supporting a node and grows
+    with the spread of the samples around it.
+    '''
+    def __init__(self, length_scale=3.0, radius=None, resolution=1.0,
+                 prior_mean=0.0, prior_var=1.0):
+        self.length_scale = float(length_scale)
+        if radius is None:
+            radius = 3 * self.length_scale
+        self.radius = float(radius)
+        self.prior_mean = prior_mean
+        self.prior_var = prior_var
+        self.grid = KernelGrid(resolution)
+        self.count = 0
+
+        # node offsets covering the kernel support
+        r = int(numpy.ceil(self.radius / resolution)) + 1
+        dx, dy = numpy.mgrid[-r:r + 1, -r:r + 1]
+        self.stencil_x = dx.ravel()
+        self.stencil_y = dy.ravel()
+
+    def add(self, x, y, value):
+        '''fold one sample at local coordinates X,Y into the nodes around it'''
+        res = self.grid.resolution
+        nx = numpy.floor(x / res) + self.stencil_x
+        ny = numpy.floor(y / res) + self.stencil_y
+        d2 = ((nx + 0.5) * res - x) ** 2 + ((ny + 0.5) * res - y) ** 2
+        near = d2 <= self.radius ** 2
+        nx = nx[near]
+        ny = ny[near]
+        w = numpy.exp(-0.5 * d2[near] / self.length_scale ** 2)
+        cx = nx.astype(numpy.int64)
+        cy = ny.astype(numpy.int64)
+        for key, rows, cols, sel in self.grid.split(cx, cy):
+            tile = self.grid.get_tile(key, create=True)
+            ws = w[sel]
+            numpy.add.at(tile['w'], (rows, cols), ws)
+            numpy.add.at(tile['wv'], (rows, cols), ws * value)
+            numpy.add.at(tile['wvv'], (rows, cols), ws * value * value)
+        self.count += 1
+
+    def estimate(self, x, y):
+        '''estimated value and standard deviation at local coordinates X,Y'''
+        nodes = self.grid.read(x, y)
+        w = nodes['w']
+        seen = w > 0
+        mean = numpy.full(w.shape, float(self.prior_mean))
+        spread = numpy.zeros(w.shape)
+        mean[seen] = nodes['wv'][seen] / w[seen]
+        spread[seen] = numpy.maximum(nodes['wvv'][seen] / w[seen] - mean[seen] ** 2, 0)
+        std = numpy.sqrt(self.prior_var / (1 + w) + spread)
+        if numpy.ndim(x) == 0 and numpy.ndim(y) == 0:
+            return float(mean[0]), float(std[0])
+        return mean, std
+
+    def weight(self, x, y):
+        '''kernel weight of the samples behind the estimate at X,Y, 0 where none reach'''
+        return self.grid.read(x, y)['w']
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+'''streaming estimate of the local pollution gradient'''
+
+import math
+import numpy
+
+
+class GradientEstimator():
+    '''
+    Least-squares plane v = a + b*x + c*y over the last WINDOW samples,
+    lightly ridge-regularised so a single straight leg still gives a slope.
+    The normal-equation sums are updated as samples enter and leave the
+    window, so each sample costs O(1). Coordinates are local metres with
+    x east and y north, so (b, c) is the gradient in value per metre.
+    '''
+    def __init__(self, window=20, ridge=1.0, resync=1000):
+        self.window = window
+        self.ridge = ridge
+        self.samples = numpy.zeros([window, 3])  # x, y, value ring buffer
+        self.next = 0
+        self.count = 0
+        self.resync = resync  # updates between exact recomputes of the sums
+        self.updates = 0
+        self.sums = numpy.zeros(9)
+
+    def terms(self, x, y, v):
+        '''1, x, y, xx, xy, yy, v, xv, yv; one column per sample when given arrays'''
+        x = numpy.asarray(x, float)
+        y = numpy.asarray(y, float)
+        v = numpy.asarray(v, float)
+        return numpy.stack([numpy.ones_like(x), x, y, x * x, x * y, y * y, v, x * v, y * v])
+
+    def add(self, x, y, value):
+        '''add one georeferenced sample, dropping the oldest when full'''
+        if self.count == self.window:
+            old = self.samples[self.next]
+            self.sums -= self.terms(old[0], old[1], old[2])
+        else:
+            self.count += 1
+        self.samples[self.next] = (x, y, value)
+        self.next = (self.next + 1) % self.window
+        self.sums += self.terms(x, y, value)
+        self.updates += 1
+        if self.updates % self.resync == 0:
+            # cancel floating point drift from the running subtraction
+            s = self.samples[:self.count]
+            self.sums = self.terms(s[:, 0], s[:, 1], s[:, 2]).sum(axis=1)
+
+    def reset(self):
+        self.next = 0
+        self.count = 0
+        self.sums[:] = 0
+
+    def gradient(self):
+        '''(d/dx, d/dy) of the field, or None until the samples span some distance'''
+        if self.count < 2:
+            return None
+        n, sx, sy, sxx, sxy, syy, sv, sxv, syv = self.sums
+        mx, my, mv = sx / n, sy / n, sv / n
+        cxx = sxx - n * mx * mx
+        cxy = sxy - n * mx * my
+        cyy = syy - n * my * my
+        if cxx + cyy <= 1e-9:
+            return None
+        # the ridge term pins the unobserved component to zero when every
+        # sample lies on one leg, leaving the along-track slope
+        A = numpy.array([[cxx + self.ridge, cxy], [cxy, cyy + self.ridge]])
+        b = numpy.array([sxv - n * mx * mv, syv - n * my * mv])
+        g = numpy.linalg.solve(A, b)
+        return (float(g[0]), float(g[1]))
+
+    def bearing(self):
+        '''compass bearing in degrees of steepest increase, or None'''
+        g = self.gradient()
+        if g is None or (g[0] == 0 and g[1] == 0):
+            return None
+        return math.degrees(math.atan2(g[0], g[1])) % 360
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+'''
+bulk decoding of telemetry and dataflash logs into numpy arrays
+
+The log is cut into chunks at record boundaries and the chunks are
+decoded in a process pool. Each message type comes back as one structured
+array with a 'time' column in seconds followed by the message fields, in
+log order. Works on MAVLink .tlog files and on the dataflash .BIN logs
+written by the dataflash_logger module.
+
+    python mp_logdecode.py mav.tlog [GLOBAL_POSITION_INT,SCALED_PRESSURE*] [out.npz]
+'''
+
+import fnmatch
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import time
+import numpy
+
+from MAVProxy.modules import mp_tlog
+
+MIN_CHUNK = 1 << 20  # bytes; smaller chunks cost more in process overhead than they save
+
+'''MAVLink struct codes as numpy types'''
+STRUCT_TYPES = {'b': 'i1', 'B': 'u1', 'c': 'S1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+                'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+DF_HEAD = b'\xa3\x95'
+DF_FMT = 128
+
+'''dataflash format characters as (numpy type, multiplier), as pymavlink's DFReader reads them'''
+DF_TYPES = {'b': ('i1', None), 'B': ('u1', None), 'h': ('<i2', None), 'H': ('<u2', None),
+            'i': ('<i4', None), 'I': ('<u4', None), 'f': ('<f4', None), 'd': ('<f8', None),
+            'n': ('S4', None), 'N': ('S16', None), 'Z': ('S64', None), 'M': ('u1', None),
+            'q': ('<i8', None), 'Q': ('<u8', None), 'a': (('<i2', (32,)), None),
+            'c': ('<i2', 0.01), 'C': ('<u2', 0.01), 'e': ('<i4', 0.01), 'E': ('<u4', 0.01),
+            'L': ('<i4', 1.0e-7)}
+
+_classes = None
+
+
+def message_classes():
+    '''{msgid: pymavlink message class}'''
+    global _classes
+    if _classes is None:
+        from pymavlink.dialects.v20 import ardupilotmega as mavlink
+        _classes = dict(mavlink.mavlink_map)
+    return _classes
+
+
+def class_name(cls):
+    return cls.msgname if hasattr(cls, 'msgname') else cls.name
+
+
+def message_dtypes(cls):
+    '''(wire dtype of the payload, output dtype) of one MAVLink message class'''
+    fmt = cls.unpacker.format
+    if not isinstance(fmt, str):
+        fmt = fmt.decode('ascii')
+    wire = []
+    for name, (count, code) in zip(cls.ordered_fieldnames, re.findall(r'(\d*)([a-zA-Z])', fmt)):
+        count = int(count or 1)
+        if code == 's':
+            wire.append((str(name), 'S%u' % count))
+        elif count > 1:
+            wire.append((str(name), STRUCT_TYPES[code], (count,)))
+        else:
+            wire.append((str(name), STRUCT_TYPES[code]))
+    wire = numpy.dtype(wire)
+    out = [('time', '<f8'), ('sysid', 'u1'), ('compid', 'u1')]
+    out += [(str(name), wire.fields[str(name)][0]) for name in cls.fieldnames]
+    return wire, numpy.dtype(out)
+
+
+def x25crc(rows, extra):
+    '''MAVLink CRC of every row of the uint8 matrix ROWS, then the CRC_EXTRA byte'''
+    crc = numpy.full(len(rows), 0xffff, numpy.uint32)
+    for k in range(rows.shape[1]):
+        crc = _crc_byte(crc, rows[:, k].astype(numpy.uint32))
+    return _crc_byte(crc, numpy.uint32(extra))
+
+
+def _crc_byte(crc, b):
+    tmp = (b ^ (crc & 0xff)) & 0xff
+    tmp = (tmp ^ (tmp << 4)) & 0xff
+    return ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xffff
+
+
+def tlog_arrays(buf, entries, msgids=None):
+    '''
+    {name: array} of the packets of ENTRIES (from mp_tlog.scan) in BUF,
+    gathered a message type and packet layout at a time. Packets whose
+    CRC does not match are dropped.
+    '''
+    base = numpy.frombuffer(buf, numpy.uint8)
+    classes = message_classes()
+    if msgids is not None:
+        entries = entries[numpy.isin(entries['msgid'], msgids)]
+    out = {}
+    for msgid in numpy.unique(entries['msgid']):
+        cls = classes.get(int(msgid))
+        if cls is None:
+            continue
+        wire, dtype = message_dtypes(cls)
+        e = entries[entries['msgid'] == msgid]
+        parts = []
+        offsets = []
+        for length in numpy.unique(e['length']):
+            g = e[e['length'] == length]
+            rows = base[g['offset'].astype(numpy.intp)[:, None] + 8 + numpy.arange(int(length))]
+            layout = rows[:, 0].astype(numpy.uint32) << 8 | rows[:, 1]
+            for key in numpy.unique(layout):
+                sel = layout == key
+                r = rows[sel]
+                v2 = r[0, 0] == mp_tlog.MAGIC_V2
+                head = 10 if v2 else 6
+                plen = int(r[0, 1])
+                crc = r[:, head + plen].astype(numpy.uint32) | r[:, head + plen + 1].astype(numpy.uint32) << 8
+                ok = x25crc(r[:, 1:head + plen], cls.crc_extra) == crc
+                r = r[ok]
+                payload = numpy.zeros((len(r), wire.itemsize), numpy.uint8)
+                n = min(plen, wire.itemsize)
+                payload[:, :n] = r[:, head:head + n]  # MAVLink 2 trims trailing zeros
+                values = payload.view(wire).ravel()
+                a = numpy.zeros(len(r), dtype)
+                a['time'] = g['time'][sel][ok] * 1.0e-6
+                a['sysid'] = r[:, 5 if v2 else 3]
+                a['compid'] = r[:, 6 if v2 else 4]
+                for name in cls.fieldnames:
+                    a[str(name)] = values[str(name)]
+                parts.append(a)
+                offsets.append(g['offset'][sel][ok])
+        if parts:
+            order = numpy.argsort(numpy.concatenate(offsets), kind='mergesort')
+            out[class_name(cls)] = numpy.concatenate(parts)[order]
+    return out
+
+
+def decode_tlog_chunk(job):
+    '''worker: the arrays of one chunk of a tlog, which starts and ends on record boundaries'''
+    filename, start, end, msgids = job
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        buf = bytearray(f.read(end - start))
+    return tlog_arrays(buf, mp_tlog.scan(buf), msgids)
+
+
+def dataflash_formats(buf):
+    '''{type: (name, length, format, columns)} from every FMT record in BUF'''
+    formats = {DF_FMT: ('FMT', 89, 'BBnNZ', ['Type', 'Length', 'Name', 'Format', 'Columns'])}
+    pos = buf.find(DF_HEAD + b'\x80')
+    while pos != -1 and pos + 89 <= len(buf):
+        rec = buf[pos + 3:pos + 89]
+        mtype, length = struct.unpack('BB', rec[:2])
+        try:
+            name = str(rec[2:6].rstrip(b'\x00').decode('ascii'))
+            fmt = str(rec[6:22].rstrip(b'\x00').decode('ascii'))
+            columns = [str(c) for c in rec[22:86].rstrip(b'\x00').decode('ascii').split(',')]
+            if (all(c in DF_TYPES for c in fmt) and len(columns) == len(fmt) and
+                    3 + numpy.dtype([('f%u' % k, DF_TYPES[c][0]) for k, c in enumerate(fmt)]).itemsize == length):
+                formats[mtype] = (name, length, fmt, columns)
+        except (UnicodeDecodeError, TypeError):
+            pass  # FMT header bytes inside some other record
+        pos = buf.find(DF_HEAD + b'\x80', pos + 1)
+    return formats
+
+
+def dataflash_dtypes(fmt, columns):
+    '''(wire dtype, output dtype) of one dataflash format'''
+    wire = []
+    out = [('time', '<f8')]
+    for c, name in zip(fmt, columns):
+        if name in [w[0] for w in wire]:
+            name += '_'
+        t, multiplier = DF_TYPES[c]
+        wire.append((name, t))
+        out.append((name, '<f8' if multiplier else t))
+    return numpy.dtype(wire), numpy.dtype(out)
+
+
+def dataflash_lengths(formats):
+    lengths = [0] * 256
+    for mtype, f in formats.items():
+        lengths[mtype] = f[1]
+    return lengths
+
+
+def dataflash_scan(buf, lengths):
+    '''(offsets, types) of the records of BUF, skipping bytes that do not start one'''
+    offsets = []
+    types = []
+    pos = 0
+    n = len(buf)
+    while pos + 3 <= n:
+        if buf[pos] == 0xA3 and buf[pos + 1] == 0x95:
+            length = lengths[buf[pos + 2]]
+            if length and pos + length <= n:
+                offsets.append(pos)
+                types.append(buf[pos + 2])
+                pos += length
+                continue
+        pos += 1
+    return numpy.array(offsets, numpy.intp), numpy.array(types, numpy.uint8)
+
+
+def dataflash_resync(buf, pos, lengths, end=None, count=4):
+    '''the first offset from POS at which COUNT records in a row frame correctly'''
+    if end is None:
+        end = len(buf)
+    while pos < end:
+        pos = buf.find(DF_HEAD, pos, end)
+        if pos == -1:
+            return end
+        p = pos
+        for _ in range(count):
+            if p + 3 > len(buf) or buf[p:p + 2] != DF_HEAD:
+                break
+            length = lengths[bytearray(buf[p + 2:p + 3])[0]]
+            if not length:
+                break
+            p += length
+        else:
+            return pos
+        if p >= len(buf) and p != pos:
+            return pos
+        pos += 1
+    return end
+
+
+def dataflash_arrays(buf, formats, mtypes=None):
+    '''{name: array} of the records of BUF, time from TimeUS or TimeMS where the format has one'''
+    base = numpy.frombuffer(buf, numpy.uint8)
+    offsets, types = dataflash_scan(buf, dataflash_lengths(formats))
+    out = {}
+    for mtype in numpy.unique(types):
+        if mtypes is not None and mtype not in mtypes:
+            continue
+        name, length, fmt, columns = formats[int(mtype)]
+        wire, dtype = dataflash_dtypes(fmt, columns)
+        rows = base[offsets[types == mtype][:, None] + 3 + numpy.arange(length - 3)]
+        values = numpy.ascontiguousarray(rows).view(wire).ravel()
+        a = numpy.zeros(len(values), dtype)
+        for (c, column) in zip(fmt, wire.names):
+            multiplier = DF_TYPES[c][1]
+            a[column] = values[column] * multiplier if multiplier else values[column]
+        if 'TimeUS' in wire.names:
+            a['time'] = values['TimeUS'] * 1.0e-6
+        elif 'TimeMS' in wire.names:
+            a['time'] = values['TimeMS'] * 1.0e-3
+        else:
+            a['time'] = numpy.nan
+        out[name] = a
+    return out
+
+
+def decode_dataflash_chunk(job):
+    '''worker: the arrays of one chunk of a dataflash log'''
+    filename, start, end, formats, mtypes = job
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        buf = bytearray(f.read(end - start))
+    return dataflash_arrays(buf, formats, mtypes)
+
+
+def selected(names, types):
+    '''the keys of NAMES ({key: name}) whose name matches one of the TYPES patterns, all if TYPES is None'''
+    if types is None:
+        return None
+    return [k for k, name in names.items() if any(fnmatch.fnmatch(name, t) for t in types)]
+
+
+def split(size, chunks, resync):
+    '''start offsets of CHUNKS roughly equal pieces, moved forward onto record boundaries by RESYNC'''
+    starts = [0]
+    for k in range(1, chunks):
+        pos = resync(size * k // chunks)
+        if pos > starts[-1] and pos < size:
+            starts.append(pos)
+    return starts + [size]
+
+
+def merge(results):
+    '''{name: array} from the per chunk dicts of RESULTS, in chunk order then by time'''
+    parts = {}
+    for arrays in results:
+        for name, a in arrays.items():
+            parts.setdefault(name, []).append(a)
+    out = {}
+    for name, arrays in parts.items():
+        a = numpy.concatenate(arrays)
+        t = a['time']
+        if len(t) > 1 and not numpy.isnan(t[0]) and numpy.any(t[1:] < t[:-1]):
+            a = a[numpy.argsort(t, kind='mergesort')]
+        out[name] = a
+    return out
+
+
+def decode(filename, types=None, processes=None, chunks=None):
+    '''
+    {name: structured array} of the TYPES (names or fnmatch patterns such
+    as SCALED_PRESSURE*, all by default) in FILENAME, decoded in CHUNKS
+    pieces over PROCESSES worker processes (the number of cores by
+    default; 1 decodes in this process)
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    size = os.path.getsize(filename)
+    if size == 0:
+        return {}
+    if chunks is None:
+        chunks = max(1, min(size // MIN_CHUNK, processes * 4))
+    with open(filename, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if m[:2] == DF_HEAD:
+                formats = dataflash_formats(m)
+                lengths = dataflash_lengths(formats)
+                mtypes = selected(dict((k, v[0]) for k, v in formats.items()), types)
+                starts = split(size, chunks, lambda pos: dataflash_resync(m, pos, lengths))
+                worker = decode_dataflash_chunk
+                jobs = [(filename, a, b, formats, mtypes) for a, b in zip(starts[:-1], starts[1:])]
+            else:
+                msgids = selected(dict((k, class_name(c)) for k, c in message_classes().items()), types)
+                starts = split(size, chunks, lambda pos: mp_tlog.resync(m, pos))
+                worker = decode_tlog_chunk
+                jobs = [(filename, a, b, msgids) for a, b in zip(starts[:-1], starts[1:])]
+        finally:
+            m.close()
+    if processes == 1 or len(jobs) == 1:
+        return merge(map(worker, jobs))
+    pool = multiprocessing.Pool(processes)
+    try:
+        return merge(pool.imap(worker, jobs))
+    finally:
+        pool.terminate()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: mp_logdecode.py LOG [TYPE,...] [OUT.npz]")
+        sys.exit(1)
+    types = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+    start = time.time()
+    arrays = decode(sys.argv[1], types)
+    print("decoded in %.2fs" % (time.time() - start))
+    for name, a in sorted(arrays.items()):
+        print("%-28s %8u" % (name, len(a)))
+    if len(sys.argv) > 3:
+        numpy.savez(sys.argv[3], **arrays)
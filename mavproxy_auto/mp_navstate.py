@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+'''versioned navigation snapshots, their subscriptions and the fused state the control loops run on'''
+
+import os
+import threading
+import time
+
+'''Pa per metre of sea water'''
+PASCALS_PER_METRE = 1025 * 9.80665
+
+SURFACE_PRESSURE = 1013.25  # hPa, used until the depth sensor is calibrated
+
+SURFACE_FILE = '/home/pi/surface_pressure.txt'  # calibration cache when no module names one
+
+
+class Snapshot(object):
+    '''
+    read-only record of one message. Subclasses name the message fields
+    they copy in both FIELDS and __slots__.
+    '''
+    __slots__ = ('version', 'time')
+    fields = ()
+
+    def __init__(self, version, t, m):
+        setattr_ = object.__setattr__
+        setattr_(self, 'version', version)
+        setattr_(self, 'time', t)
+        for f in self.fields:
+            setattr_(self, f, getattr(m, f))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is read only" % self.__class__.__name__)
+
+    def changed(self, m):
+        '''True if message M differs from this snapshot in any field'''
+        for f in self.fields:
+            if getattr(m, f) != getattr(self, f):
+                return True
+        return False
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join("%s=%s" % (f, getattr(self, f)) for f in ('version', 'time') + self.fields))
+
+
+class Position(Snapshot):
+    __slots__ = fields = ('lat', 'lon', 'alt', 'relative_alt', 'vx', 'vy', 'vz', 'hdg')
+
+
+class Attitude(Snapshot):
+    __slots__ = fields = ('roll', 'pitch', 'yaw', 'rollspeed', 'pitchspeed', 'yawspeed')
+
+
+class Hud(Snapshot):
+    __slots__ = fields = ('airspeed', 'groundspeed', 'heading', 'throttle', 'alt', 'climb')
+
+
+class Topic():
+    '''
+    latest snapshot of one message type. Callbacks run in the thread that
+    publishes; other threads can block in wait() for a newer version.
+    '''
+    def __init__(self, snapshot_type):
+        self.snapshot_type = snapshot_type
+        self.version = 0
+        self.latest = None
+        self.callbacks = []
+        self.condition = threading.Condition()
+
+    def subscribe(self, callback):
+        '''call CALLBACK(snapshot) on every change'''
+        self.callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def publish(self, m, t):
+        '''snapshot message M if it changed anything, returning the new snapshot or None'''
+        if self.latest is not None and not self.latest.changed(m):
+            return None
+        with self.condition:
+            self.version += 1
+            self.latest = self.snapshot_type(self.version, t, m)
+            self.condition.notify_all()
+        for callback in self.callbacks:
+            callback(self.latest)
+        return self.latest
+
+    def wait(self, version=0, timeout=None):
+        '''the first snapshot newer than VERSION, or None after TIMEOUT seconds'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.version <= version:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.latest
+
+
+class Fused(Snapshot):
+    '''degrees, degrees per second, metres and metres per second; *_valid is False once an input has gone stale'''
+    __slots__ = fields = ('roll', 'pitch', 'heading', 'rollspeed', 'pitchspeed', 'yawspeed',
+                          'groundspeed', 'depth', 'depth_rate', 'heading_valid', 'depth_valid')
+
+
+def pressure_depth(press_abs, surface=SURFACE_PRESSURE):
+    '''metres below the surface for an absolute pressure in hPa'''
+    return (press_abs - surface) * 100.0 / PASCALS_PER_METRE
+
+
+class DepthGauge():
+    '''
+    depth from SCALED_PRESSURE press_abs against a surface reading.
+    calibrate() averages the next SAMPLES readings, which must be taken at
+    the surface, and caches the result in FILENAME so a restart mid-mission
+    keeps the calibration.
+    '''
+    def __init__(self, filename=SURFACE_FILE, samples=20):
+        self.samples = samples
+        self.pending = 0
+        self.total = 0.0
+        self.depth = 0.0
+        self.load(filename)
+
+    def load(self, filename):
+        '''cache the calibration in FILENAME from now on, taking up the one already there'''
+        self.filename = filename
+        self.surface = SURFACE_PRESSURE
+        self.calibrated = False
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as f:
+                self.surface = float(f.read())
+            self.calibrated = True
+
+    def calibrate(self):
+        self.pending = self.samples
+        self.total = 0.0
+
+    def update(self, press_abs):
+        '''feed one reading, returning the depth in metres'''
+        if self.pending > 0:
+            self.total += press_abs
+            self.pending -= 1
+            if self.pending == 0:
+                self.surface = self.total / self.samples
+                self.calibrated = True
+                if self.filename is not None:
+                    with open(self.filename, 'w') as f:
+                        f.write("%f\n" % self.surface)
+        self.depth = pressure_depth(press_abs, self.surface)
+        return self.depth
+
+
+class NavFusion():
+    '''
+    One navigation state built up message by message: ATTITUDE gives roll,
+    pitch, heading and their rates, VFR_HUD the speed and climb, pressure
+    the depth. GLOBAL_POSITION_INT hdg stands in for the heading only when
+    ATTITUDE has been quiet for HEADING_TIMEOUT seconds. On output the
+    heading and depth are carried forward along their rates to the time of
+    the triggering message, for at most two output periods, so the loops
+    see the state now rather than as of the slowest input. A heading or
+    depth with no reading for STALE_TIMEOUT seconds is flagged invalid.
+    Outputs are published to TOPIC at most RATE times a second.
+
+    Every module handed the same message can feed it: a message object
+    already taken in is ignored, so the modules can share one instance
+    through fusion().
+    '''
+    def __init__(self, rate=10.0, rate_filter=0.3, heading_timeout=1.0, stale_timeout=1.0, gauge=None):
+        self.topic = Topic(Fused)
+        self.rate = rate
+        self.rate_filter = rate_filter
+        self.heading_timeout = heading_timeout
+        self.stale_timeout = stale_timeout
+        self.gauge = gauge  # DepthGauge turning SCALED_PRESSURE into depth
+        self.seen = {}
+        self.heading_valid = self.depth_valid = False
+        self.roll = self.pitch = self.heading = 0.0
+        self.rollspeed = self.pitchspeed = self.yawspeed = 0.0
+        self.groundspeed = 0.0
+        self.depth = self.depth_rate = 0.0
+        self.climb = 0.0
+        self.measured_heading = None
+        self.heading_time = None
+        self.attitude_time = None
+        self.measured_depth = None
+        self.depth_time = None
+        self.last_output = None
+
+    def fresh(self, kind, m):
+        '''False if M is the message of KIND already taken in'''
+        if self.seen.get(kind) is m:
+            return False
+        self.seen[kind] = m
+        return True
+
+    def attitude(self, m, t):
+        if not self.fresh('attitude', m):
+            return None
+        self.roll = m.roll * 57.29577951308232
+        self.pitch = m.pitch * 57.29577951308232
+        self.rollspeed = m.rollspeed * 57.29577951308232
+        self.pitchspeed = m.pitchspeed * 57.29577951308232
+        self.yawspeed = m.yawspeed * 57.29577951308232
+        self.measured_heading = (m.yaw * 57.29577951308232) % 360.0
+        self.heading_time = self.attitude_time = t
+        return self.output(t)
+
+    def position(self, m, t):
+        if not self.fresh('position', m):
+            return None
+        if m.hdg == 65535:
+            return None
+        if self.attitude_time is not None and t - self.attitude_time < self.heading_timeout:
+            return None
+        self.measured_heading = m.hdg / 100.0
+        self.yawspeed = 0.0
+        self.heading_time = t
+        return self.output(t)
+
+    def hud(self, m, t):
+        if not self.fresh('hud', m):
+            return None
+        self.groundspeed = m.groundspeed
+        self.climb = m.climb
+        if self.depth_time is None:
+            self.depth_rate = -m.climb
+        return self.output(t)
+
+    def pressure(self, m, t):
+        '''SCALED_PRESSURE through the depth gauge'''
+        if not self.fresh('pressure', m):
+            return None
+        return self.depth_reading(self.gauge.update(m.press_abs), t)
+
+    def depth_reading(self, depth, t):
+        '''depth in metres, from a calibrated pressure sensor'''
+        if self.depth_time is not None and t > self.depth_time:
+            rate = (depth - self.measured_depth) / (t - self.depth_time)
+            self.depth_rate += self.rate_filter * (rate - self.depth_rate)
+        self.measured_depth = depth
+        self.depth_time = t
+        return self.output(t)
+
+    def output(self, t):
+        '''publish the state carried forward to T, if an output is due'''
+        if self.last_output is not None and t - self.last_output < 1.0 / self.rate:
+            return None
+        self.last_output = t
+        horizon = 2.0 / self.rate
+        if self.heading_time is not None:
+            age = t - self.heading_time
+            self.heading = (self.measured_heading + self.yawspeed * min(age, horizon)) % 360.0
+            self.heading_valid = age <= self.stale_timeout
+        if self.depth_time is not None:
+            age = t - self.depth_time
+            self.depth = self.measured_depth + self.depth_rate * min(age, horizon)
+            self.depth_valid = age <= self.stale_timeout
+        return self.topic.publish(self, t)
+
+
+_fusion = None
+
+
+def fusion(rate=10.0, surface_file=None):
+    '''
+    the NavFusion shared by the modules of this MAVProxy, created on first
+    use with its own DepthGauge. It runs at the highest RATE asked for. A
+    SURFACE_FILE moves the gauge's calibration cache there, whichever
+    module loaded first; without one it keeps the default cache.
+    '''
+    global _fusion
+    if _fusion is None:
+        _fusion = NavFusion(rate, gauge=DepthGauge(surface_file or SURFACE_FILE))
+    _fusion.rate = max(_fusion.rate, rate)
+    if surface_file is not None and surface_file != _fusion.gauge.filename:
+        _fusion.gauge.load(surface_file)
+    return _fusion
+
+
+def reset_fusion():
+    '''forget the shared NavFusion, so the next fusion() starts afresh'''
+    global _fusion
+    _fusion = None
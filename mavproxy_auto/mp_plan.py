@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+'''compile sparse/dense surveys into a fixed maneuver schedule'''
+
+import numpy
+
+PHASES = ['transit', 'sparse', 'dense', 'idle']
+
+'''one maneuver: the [axis, pwm, seconds] command_queue entry, the target depth of a z segment, plus its predictions'''
+SEGMENT_DTYPE = numpy.dtype([('axis', 'S4'), ('pwm', '<u2'), ('seconds', '<f4'),
+                             ('phase', 'u1'), ('start', '<f4'), ('distance', '<f4'),
+                             ('energy', '<f4'), ('depth', '<f4')])
+
+
+class MotionModel():
+    '''
+    predicted speed and power of each maneuver.
+    Defaults follow the assumptions already in the module: one second of
+    forward thrust at 1600 covers one metre and a 2 second yaw pulse is a
+    quarter turn. POWER is watts per axis at full deflection (400us from
+    neutral), scaled with the square of the deflection.
+    '''
+    def __init__(self, speed=1.0, yaw_seconds=2.0, power=None, hotel=5.0):
+        self.speed = speed  # m/s at 100us forward deflection
+        self.yaw_seconds = yaw_seconds  # seconds per 90 degree turn
+        self.power = {'f': 120.0, 'l': 120.0, 'z': 120.0, 'yaw': 60.0, 'roll': 60.0}
+        if power is not None:
+            self.power.update(power)
+        self.hotel = hotel  # electronics and sensors, watts
+
+    def distance(self, axis, pwm, seconds):
+        if axis in ('f', 'l'):
+            return self.speed * seconds * abs(pwm - 1500) / 100.0
+        return 0.0
+
+    def energy(self, axis, pwm, seconds):
+        '''joules for one maneuver'''
+        deflection = min(abs(pwm - 1500) / 400.0, 1.0)
+        return (self.power.get(axis, 0.0) * deflection ** 2 + self.hotel) * seconds
+
+
+class PlanBuilder():
+    '''collects maneuvers in order; compile() freezes them into a schedule'''
+    def __init__(self, model=None, forward_pwm=1600, yaw_pwm=1550):
+        self.model = model or MotionModel()
+        self.forward_pwm = forward_pwm
+        self.yaw_pwm = yaw_pwm
+        self.segments = []
+        self.phase = 'transit'
+
+    def add(self, axis, pwm, seconds, depth=0.0):
+        self.segments.append((axis, pwm, seconds, PHASES.index(self.phase), depth))
+
+    def forward(self, metres):
+        '''drive straight, sized from the model speed at the forward pwm'''
+        speed = self.model.distance('f', self.forward_pwm, 1.0)
+        self.add('f', self.forward_pwm, metres / speed)
+
+    def turn(self, degrees):
+        '''yaw for the time a turn is predicted to take; positive is ccw'''
+        diff = abs(self.yaw_pwm - 1500)
+        pwm = 1500 - diff if degrees > 0 else 1500 + diff
+        self.add('yaw', pwm, self.model.yaw_seconds * abs(degrees) / 90.0)
+
+    def dive(self, seconds=3, depth=1.0):
+        '''descend to DEPTH metres, predicted to take SECONDS'''
+        self.add('z', 1400, seconds, depth)
+
+    def surface(self, seconds=5):
+        self.add('z', 1600, seconds, 0.0)
+
+    def dense(self, forward_increment=3, forward_travel_distance=5, sideways_distance=4):
+        '''the maneuvers dense_traverse queues'''
+        phase, self.phase = self.phase, 'dense'
+        self.turn(90)
+        self.forward(sideways_distance)
+        turn_direction = -90
+        for _ in range(forward_travel_distance):
+            self.turn(turn_direction)
+            self.forward(forward_increment)
+            self.turn(turn_direction)
+            self.forward(sideways_distance)
+            turn_direction *= -1
+        self.turn(turn_direction)
+        self.forward(3)
+        self.turn(turn_direction)
+        self.forward(sideways_distance / 2.0)
+        self.turn(-turn_direction)
+        self.phase = phase
+
+    def lawnmower(self, legs, leg_length, spacing, dense_at=None, dense_params=(), depth=1.0):
+        '''
+        sparse survey of LEGS parallel legs, SPACING metres apart, at DEPTH.
+        DENSE_AT maps a leg number to the distances along it at which to
+        insert a dense pattern.
+        '''
+        dense_at = dense_at or {}
+        self.phase = 'transit'
+        self.dive(depth=depth)
+        turn = 90
+        for leg in range(legs):
+            self.phase = 'sparse'
+            travelled = 0.0
+            for at in sorted(dense_at.get(leg, [])):
+                self.forward(at - travelled)
+                self.dense(*dense_params)
+                travelled = at
+            self.forward(leg_length - travelled)
+            if leg < legs - 1:
+                self.phase = 'transit'
+                self.turn(turn)
+                self.forward(spacing)
+                self.turn(turn)
+                turn = -turn
+        self.phase = 'transit'
+        self.surface()
+
+    def compile(self):
+        '''freeze into a read-only SEGMENT_DTYPE array with predictions filled in'''
+        plan = numpy.zeros(len(self.segments), SEGMENT_DTYPE)
+        if len(self.segments):
+            axis, pwm, seconds, phase, depth = zip(*self.segments)
+            plan['axis'] = axis
+            plan['pwm'] = pwm
+            plan['seconds'] = seconds
+            plan['phase'] = phase
+            plan['depth'] = depth
+            plan['start'][1:] = numpy.cumsum(plan['seconds'])[:-1]
+            m = self.model
+            plan['distance'] = [m.distance(a, p, s) for a, p, s, _, _ in self.segments]
+            plan['energy'] = [m.energy(a, p, s) for a, p, s, _, _ in self.segments]
+        plan.flags.writeable = False
+        return plan
+
+
+def totals(plan):
+    '''(seconds, metres, joules) for a compiled plan'''
+    return (float(plan['seconds'].sum()), float(plan['distance'].sum()), float(plan['energy'].sum()))
+
+
+def phase_totals(plan):
+    '''{phase: (seconds, metres, joules)}'''
+    out = {}
+    for i, name in enumerate(PHASES):
+        sel = plan[plan['phase'] == i]
+        if len(sel):
+            out[name] = totals(sel)
+    return out
+
+
+def commands(plan, yaw_seconds=None, depth_timeout=None):
+    '''
+    the plan as command_queue entries. Given the YAW_SECONDS per quarter
+    turn the plan was built with, yaw pulses become closed loop turns; given
+    DEPTH_TIMEOUT, dives and surfacings become depth holds that give up on
+    reaching their target after that many seconds.
+    '''
+    out = []
+    for a, p, s, d in zip(plan['axis'], plan['pwm'], plan['seconds'], plan['depth']):
+        a = a.decode('ascii') if isinstance(a, bytes) else a
+        p = int(p)
+        if a == 'yaw' and yaw_seconds:
+            degrees = 90.0 * float(s) / yaw_seconds
+            out.append(['turn', degrees if p < 1500 else -degrees, abs(p - 1500)])
+        elif a == 'z' and depth_timeout:
+            out.append(['depth', float(d), depth_timeout])
+        else:
+            out.append([a, p, float(s)])
+    return out
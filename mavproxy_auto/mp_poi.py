@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+'''ordering of points of interest into a short inspection tour'''
+
+import time
+import numpy
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def distance(points, a, b):
+    return numpy.hypot(points[a, 0] - points[b, 0], points[a, 1] - points[b, 1])
+
+
+def tour_length(points, tour):
+    '''length of the open path visiting POINTS in TOUR order'''
+    p = points[tour]
+    return float(numpy.hypot(*numpy.diff(p, axis=0).T).sum())
+
+
+def nearest_lists(points, k):
+    '''indices of the K nearest other points of every point'''
+    k = min(k, len(points) - 1)
+    if k <= 0:
+        return numpy.zeros([len(points), 0], int)
+    if cKDTree is not None:
+        _, idx = cKDTree(points).query(points, k + 1)
+        return idx[:, 1:]
+    d = numpy.hypot(points[:, None, 0] - points[None, :, 0], points[:, None, 1] - points[None, :, 1])
+    return numpy.argsort(d, axis=1)[:, 1:k + 1]
+
+
+def greedy_tour(points, neighbours):
+    '''nearest neighbour path from point 0, using the neighbour lists where they suffice'''
+    n = len(points)
+    visited = numpy.zeros(n, bool)
+    tour = [0]
+    visited[0] = True
+    current = 0
+    for _ in range(n - 1):
+        nxt = -1
+        for j in neighbours[current]:
+            if not visited[j]:
+                nxt = j
+                break
+        if nxt < 0:
+            # every listed neighbour is taken, fall back to a full scan
+            d = numpy.hypot(points[:, 0] - points[current, 0], points[:, 1] - points[current, 1])
+            d[visited] = numpy.inf
+            nxt = int(numpy.argmin(d))
+        visited[nxt] = True
+        tour.append(nxt)
+        current = nxt
+    return tour
+
+
+def two_opt(points, tour, neighbours, deadline):
+    '''reverse segments while it shortens the path; tour[0] stays fixed'''
+    n = len(tour)
+    position = numpy.empty(n, int)
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        position[tour] = numpy.arange(n)
+        for i in range(n - 1):
+            a, b = tour[i], tour[i + 1]
+            d_ab = distance(points, a, b)
+            for c in neighbours[a]:
+                j = position[c]
+                if j <= i + 1:
+                    continue
+                # replace a-b and c-d with a-c and b-d
+                delta = distance(points, a, c) - d_ab
+                if j + 1 < n:
+                    d = tour[j + 1]
+                    delta += distance(points, b, d) - distance(points, c, d)
+                if delta < -1e-9:
+                    tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                    position[tour] = numpy.arange(n)
+                    improved = True
+                    break
+            if time.time() > deadline:
+                break
+    return tour
+
+
+def or_opt(points, tour, neighbours, deadline, max_segment=3):
+    '''move short segments next to a nearer point while it shortens the path'''
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for length in range(1, max_segment + 1):
+            i = 1
+            while i + length <= len(tour) and time.time() < deadline:
+                seg = tour[i:i + length]
+                prev = tour[i - 1]
+                nxt = tour[i + length] if i + length < len(tour) else None
+                removed = distance(points, prev, seg[0])
+                if nxt is not None:
+                    removed += distance(points, seg[-1], nxt) - distance(points, prev, nxt)
+                rest = tour[:i] + tour[i + length:]
+                best = None
+                for c in neighbours[seg[0]]:
+                    if c in seg:
+                        continue
+                    k = rest.index(c)
+                    for s in (seg, seg[::-1]):
+                        # insert S between rest[k] and rest[k+1]
+                        added = distance(points, c, s[0])
+                        if k + 1 < len(rest):
+                            added += distance(points, s[-1], rest[k + 1]) - distance(points, c, rest[k + 1])
+                        if added - removed < -1e-9 and (best is None or added - removed < best[0]):
+                            best = (added - removed, k, s)
+                if best is not None:
+                    _, k, s = best
+                    tour[:] = rest[:k + 1] + list(s) + rest[k + 1:]
+                    improved = True
+                else:
+                    i += 1
+    return tour
+
+
+def plan_tour(points, start, time_budget=0.5, neighbours=8):
+    '''
+    order POINTS (N x 2, local metres) for a vehicle at START.
+    Builds the neighbour lists once, takes the greedy nearest neighbour path
+    and improves it with 2-opt and Or-opt until TIME_BUDGET seconds are spent.
+    Returns indices into POINTS in visiting order.
+    '''
+    points = numpy.asarray(points, float).reshape(-1, 2)
+    if len(points) == 0:
+        return []
+    deadline = time.time() + time_budget
+    nodes = numpy.vstack([numpy.asarray(start, float).reshape(1, 2), points])
+    near = nearest_lists(nodes, neighbours)
+    tour = greedy_tour(nodes, near)
+    while time.time() < deadline:
+        before = tour_length(nodes, tour)
+        two_opt(nodes, tour, near, deadline)
+        or_opt(nodes, tour, near, deadline)
+        if tour_length(nodes, tour) >= before - 1e-9:
+            break
+    return [int(t) - 1 for t in tour[1:]]
+
+
+def tour_latlon(points, order, origin):
+    '''convert ordered local x (east), y (north) metres into (lat, lng) about ORIGIN'''
+    from MAVProxy.modules.lib import mp_util
+    return [mp_util.gps_offset(origin[0], origin[1], points[i][0], points[i][1]) for i in order]
+
+
+def merge_points(points, thresh, values=None):
+    '''
+    merge points of interest closer than THRESH in linear time.
+    Points are hashed into square cells of side THRESH, so any point within
+    THRESH of another sits in the same or a neighbouring cell and only those
+    are compared. The close pairs are then taken nearest first and join
+    their clusters only if every point of one is within THRESH of every
+    point of the other (complete linkage), so no cluster is wider than
+    THRESH however the points chain. Each cluster becomes its centroid
+    weighted by VALUES (the readings, equal weights if None), keeping the
+    peak reading. Returns (centroids, peaks, sizes).
+    '''
+    points = numpy.asarray(points, float).reshape(-1, 2)
+    n = len(points)
+    if values is None:
+        values = numpy.ones(n)
+    values = numpy.asarray(values, float)
+    parent = list(range(n))
+    members = dict((i, [i]) for i in range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    cells = {}
+    keys = numpy.floor(points / thresh).astype(numpy.int64)
+    for i in range(n):
+        cells.setdefault((keys[i, 0], keys[i, 1]), []).append(i)
+    limit = thresh * thresh
+    pairs = []
+    for (cx, cy), cell in cells.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                # visit each pair of cells once
+                if (dx, dy) < (0, 0):
+                    continue
+                other = cells.get((cx + dx, cy + dy))
+                if other is None:
+                    continue
+                a = numpy.array(cell)
+                b = numpy.array(other)
+                d = ((points[a, None, :] - points[None, b, :]) ** 2).sum(axis=2)
+                close = d < limit
+                if (dx, dy) == (0, 0):
+                    close &= a[:, None] < b[None, :]
+                i, j = numpy.nonzero(close)
+                pairs.append((d[i, j], a[i], b[j]))
+
+    if pairs:
+        d, a, b = [numpy.concatenate(x) for x in zip(*pairs)]
+        apart = set()  # root pairs too wide to join; growing either cluster keeps them so
+        for k in numpy.argsort(d, kind='mergesort'):
+            ri, rj = find(a[k]), find(b[k])
+            if ri == rj or (ri, rj) in apart:
+                continue
+            mi, mj = members[ri], members[rj]
+            if len(mi) > 1 or len(mj) > 1:
+                span = ((points[mi, None, :] - points[None, mj, :]) ** 2).sum(axis=2)
+                if span.max() >= limit:
+                    apart.add((ri, rj))
+                    apart.add((rj, ri))
+                    continue
+            parent[ri] = rj
+            mj.extend(members.pop(ri))
+
+    roots = numpy.array([find(i) for i in range(n)], int)
+    labels, inverse = numpy.unique(roots, return_inverse=True)
+    inverse = inverse.ravel()
+    weights = numpy.maximum(values, 1e-12)
+    total = numpy.bincount(inverse, weights)
+    centroids = numpy.stack([numpy.bincount(inverse, weights * points[:, 0]) / total,
+                             numpy.bincount(inverse, weights * points[:, 1]) / total], axis=1)
+    peaks = numpy.full(len(labels), -numpy.inf)
+    numpy.maximum.at(peaks, inverse, values)
+    return centroids, peaks, numpy.bincount(inverse)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+'''sparse tiled pollution map storage'''
+
+import os
+import time
+import numpy
+
+'''per-cell record: number of samples, running sum and time of last update'''
+CELL_DTYPE = numpy.dtype([('count', '<u4'), ('sum', '<f8'), ('time', '<f8')])
+
+'''
+Map file layout, readable with plain numpy.memmap:
+  one 64 byte HEADER_DTYPE record
+  CAPACITY tile records of tile_record_dtype(tile_size), the first NTILES in use
+'''
+MAP_MAGIC = b'AUVPMAP1'
+HEADER_DTYPE = numpy.dtype([('magic', 'S8'), ('version', '<u4'), ('tile_size', '<u4'),
+                            ('capacity', '<u4'), ('ntiles', '<u4'), ('resolution', '<f8'),
+                            ('origin', '<f8', (2,)), ('reserved', 'V16')])
+
+
+def tile_record_dtype(tile_size):
+    '''on-disk tile: its (tile_x, tile_y) key followed by the cells'''
+    return numpy.dtype([('key', '<i4', (2,)), ('cells', CELL_DTYPE, (tile_size, tile_size))])
+
+
+class PollutionMap():
+    '''
+    Pollution samples binned into square cells of RESOLUTION metres.
+    Cells are grouped into TILE_SIZE x TILE_SIZE tiles that are only allocated
+    the first time a sample lands in them, so memory follows the area the AUV
+    has actually covered rather than the size of the fence.
+    Coordinates are local x,y in metres from the map origin and may be negative.
+    '''
+    cell_dtype = CELL_DTYPE
+
+    def __init__(self, resolution=1.0, tile_size=64, origin=(0.0, 0.0)):
+        self.resolution = float(resolution)
+        self.tile_size = int(tile_size)
+        self.origin = (float(origin[0]), float(origin[1]))  # lat,lng of local (0,0)
+        self.tiles = {}  # (tile_x, tile_y) -> tile_size x tile_size cell_dtype array
+
+    def new_tile(self, key):
+        '''allocate an empty tile'''
+        return numpy.zeros([self.tile_size, self.tile_size], self.cell_dtype)
+
+    def get_tile(self, key, create=False):
+        '''return the tile at KEY, allocating it if CREATE is set'''
+        tile = self.tiles.get(key)
+        if tile is None and create:
+            tile = self.new_tile(key)
+            self.tiles[key] = tile
+        return tile
+
+    def cell_index(self, x, y):
+        '''convert local coordinates in metres to integer cell indices'''
+        cx = numpy.floor(numpy.asarray(x, float) / self.resolution).astype(numpy.int64)
+        cy = numpy.floor(numpy.asarray(y, float) / self.resolution).astype(numpy.int64)
+        return numpy.atleast_1d(cx), numpy.atleast_1d(cy)
+
+    def split(self, cx, cy):
+        '''group cell indices by tile, yielding (key, row, column, selection)'''
+        tx = cx // self.tile_size
+        ty = cy // self.tile_size
+        rows = cx - tx * self.tile_size
+        cols = cy - ty * self.tile_size
+        if len(tx) == 1:
+            yield (int(tx[0]), int(ty[0])), rows, cols, slice(None)
+            return
+        keys = numpy.stack([tx, ty], axis=1)
+        unique, inverse, counts = numpy.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        order = numpy.argsort(inverse.ravel(), kind='mergesort')
+        ends = numpy.cumsum(counts)
+        for i in range(len(unique)):
+            sel = order[ends[i] - counts[i]:ends[i]]
+            yield (int(unique[i][0]), int(unique[i][1])), rows[sel], cols[sel], sel
+
+    def add(self, x, y, value, t=None):
+        '''add one or more samples at local coordinates X,Y'''
+        cx, cy = self.cell_index(x, y)
+        value = numpy.broadcast_to(numpy.asarray(value, float), cx.shape)
+        if t is None:
+            t = time.time()
+        t = numpy.broadcast_to(numpy.asarray(t, float), cx.shape)
+        for key, rows, cols, sel in self.split(cx, cy):
+            tile = self.get_tile(key, create=True)
+            numpy.add.at(tile['count'], (rows, cols), 1)
+            numpy.add.at(tile['sum'], (rows, cols), value[sel])
+            numpy.maximum.at(tile['time'], (rows, cols), t[sel])
+            self.tile_changed(key, tile)
+
+    def tile_changed(self, key, tile):
+        '''hook called after a tile has been written'''
+        pass
+
+    def read(self, x, y):
+        '''return the cell records at local coordinates X,Y; unvisited cells are zero'''
+        cx, cy = self.cell_index(x, y)
+        out = numpy.zeros(cx.shape, self.cell_dtype)
+        for key, rows, cols, sel in self.split(cx, cy):
+            tile = self.get_tile(key)
+            if tile is not None:
+                out[sel] = tile[rows, cols]
+        return out
+
+    def mean(self, x, y):
+        '''mean reading at local coordinates X,Y, NaN where nothing was sampled'''
+        cells = self.read(x, y)
+        out = numpy.full(cells.shape, numpy.nan)
+        seen = cells['count'] > 0
+        out[seen] = cells['sum'][seen] / cells['count'][seen]
+        return out
+
+    def bounds(self):
+        '''(min_x, min_y, max_x, max_y) cell indices covered by allocated tiles'''
+        if not self.tiles:
+            return None
+        keys = numpy.array(list(self.tiles.keys()))
+        lo = keys.min(axis=0) * self.tile_size
+        hi = (keys.max(axis=0) + 1) * self.tile_size - 1
+        return (int(lo[0]), int(lo[1]), int(hi[0]), int(hi[1]))
+
+    def to_dense(self, field='mean'):
+        '''assemble the allocated tiles into one dense array for export'''
+        b = self.bounds()
+        if b is None:
+            return numpy.zeros([0, 0])
+        out = numpy.zeros([b[2] - b[0] + 1, b[3] - b[1] + 1])
+        for (tx, ty), tile in self.tiles.items():
+            r = tx * self.tile_size - b[0]
+            c = ty * self.tile_size - b[1]
+            if field == 'mean':
+                values = tile['sum'] / numpy.maximum(tile['count'], 1)
+            else:
+                values = tile[field]
+            out[r:r + self.tile_size, c:c + self.tile_size] = values
+        return out
+
+    def memory_usage(self):
+        '''bytes held by allocated tiles'''
+        return len(self.tiles) * self.tile_size * self.tile_size * self.cell_dtype.itemsize
+
+
+class PollutionMapFile(PollutionMap):
+    '''
+    PollutionMap whose tiles live in a memory-mapped file.
+    Opening an existing file maps it and carries on where it left off, so a
+    restart mid-dive keeps the map collected so far. Dirty pages are flushed
+    at most every FLUSH_INTERVAL seconds and on close().
+    '''
+    def __init__(self, filename, resolution=1.0, tile_size=64, origin=(0.0, 0.0),
+                 capacity=16, flush_interval=1.0, readonly=False):
+        PollutionMap.__init__(self, resolution, tile_size, origin)
+        self.filename = filename
+        self.mode = 'r' if readonly else 'r+'
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.dirty = False
+        if not os.path.exists(filename):
+            if readonly:
+                raise IOError("No pollution map at %s" % filename)
+            self.create(capacity)
+        self.map_file()
+
+    def create(self, capacity):
+        '''write an empty map file'''
+        header = numpy.zeros(1, HEADER_DTYPE)
+        header['magic'] = MAP_MAGIC
+        header['version'] = 1
+        header['tile_size'] = self.tile_size
+        header['capacity'] = capacity
+        header['resolution'] = self.resolution
+        header['origin'] = self.origin
+        with open(self.filename, 'wb') as f:
+            header.tofile(f)
+            f.truncate(HEADER_DTYPE.itemsize + capacity * tile_record_dtype(self.tile_size).itemsize)
+
+    def map_file(self):
+        '''map the header and tile records and index the tiles in use'''
+        self.header = numpy.memmap(self.filename, HEADER_DTYPE, self.mode, 0, (1,))
+        if self.header['magic'][0] != MAP_MAGIC:
+            raise ValueError("%s is not a pollution map" % self.filename)
+        self.tile_size = int(self.header['tile_size'][0])
+        self.resolution = float(self.header['resolution'][0])
+        self.origin = tuple(float(v) for v in self.header['origin'][0])
+        capacity = int(self.header['capacity'][0])
+        self.records = numpy.memmap(self.filename, tile_record_dtype(self.tile_size), self.mode,
+                                    HEADER_DTYPE.itemsize, (capacity,))
+        self.tiles = {}
+        for i in range(int(self.header['ntiles'][0])):
+            key = self.records['key'][i]
+            self.tiles[(int(key[0]), int(key[1]))] = self.records['cells'][i]
+
+    def grow(self):
+        '''double the number of tile records the file can hold'''
+        self.flush()
+        capacity = 2 * int(self.header['capacity'][0])
+        with open(self.filename, 'r+b') as f:
+            f.truncate(HEADER_DTYPE.itemsize + capacity * self.records.dtype.itemsize)
+        self.header['capacity'] = capacity
+        self.header.flush()
+        self.map_file()
+
+    def new_tile(self, key):
+        '''claim the next free tile record'''
+        n = int(self.header['ntiles'][0])
+        if n == int(self.header['capacity'][0]):
+            self.grow()
+        self.records['key'][n] = key
+        # only count the tile once its key is written
+        self.header['ntiles'] = n + 1
+        return self.records['cells'][n]
+
+    def set_origin(self, lat, lng):
+        '''georeference local (0,0)'''
+        self.origin = (float(lat), float(lng))
+        self.header['origin'] = self.origin
+        self.dirty = True
+
+    def tile_changed(self, key, tile):
+        self.dirty = True
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''push changed cells to disk'''
+        self.last_flush = time.time()
+        if self.dirty and self.mode != 'r':
+            self.records.flush()
+            self.header.flush()
+        self.dirty = False
+
+    def close(self):
+        self.flush()
+        self.tiles = {}
+        del self.records
+        del self.header
+
+
+def load_map(filename):
+    '''open a saved map read-only for post-processing'''
+    return PollutionMapFile(filename, readonly=True)
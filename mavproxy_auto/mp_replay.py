@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+'''
+replay a telemetry log through the auto module without MAVProxy
+
+Packets from the log are fed to AUVModule.mavlink_packet in order, with
+idle_task run between them as often as the MAVProxy main loop would.
+While the replay runs time.time() reads the log clock, so the module's
+timers and command timeouts follow the recorded dive however fast it is
+replayed. Everything the module sends is encoded and captured instead of
+going to a vehicle.
+
+    python mp_replay.py mav.tlog [SPEED ["auto depth 2" ...]]
+
+SPEED 1 is real time, 10 ten times real time and 0 (the default) as fast
+as possible. Any further arguments are run as module commands first.
+'''
+
+import contextlib
+import sys
+import tempfile
+import time
+import traceback
+import numpy
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+
+from MAVProxy.modules import mp_navstate
+from MAVProxy.modules import mp_tlog
+
+_wall_time = time.time  # the real clock, kept for pacing while time.time is the log clock
+
+
+class LogClock():
+    '''time.time() as the module sees it: the log time being replayed'''
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class NullFile():
+    def write(self, buf):
+        pass
+
+
+class ReplayMaster():
+    '''
+    stands in for the mavfile of a live link. Sends go through a real
+    MAVLink encoder, so a message that would not pack fails here as it
+    would in flight, and each one is kept with the log time it was sent
+    at and the wall time since the packet that caused it was delivered.
+    '''
+    def __init__(self, clock):
+        self.clock = clock
+        self.mav = mavlink.MAVLink(NullFile(), 255, 0)
+        self.mav.set_send_callback(self.capture)
+        self.messages = {}
+        self.target_system = 1
+        self.target_component = 1
+        self.sent = []  # (log time, latency, cause, message)
+        self.cause = ('start', _wall_time())
+
+    def capture(self, m):
+        self.sent.append((self.clock.now, _wall_time() - self.cause[1], self.cause[0], m))
+
+    def waypoint_request_send(self, seq):
+        self.mav.mission_request_send(self.target_system, self.target_component, seq)
+
+    def waypoint_request_list_send(self):
+        self.mav.mission_request_list_send(self.target_system, self.target_component)
+
+    def waypoint_count_send(self, count):
+        self.mav.mission_count_send(self.target_system, self.target_component, count)
+
+    def waypoint_clear_all_send(self):
+        self.mav.mission_clear_all_send(self.target_system, self.target_component)
+
+    def waypoint_set_current_send(self, seq):
+        self.mav.mission_set_current_send(self.target_system, self.target_component, seq)
+
+    def recv_match(self, condition=None, type=None, blocking=False, timeout=None):
+        return None  # nothing answers a replay
+
+
+class ReplaySettings():
+    def __init__(self):
+        self.target_system = 0
+        self.target_component = 0
+        self.wpupdates = False
+        self.moddebug = 1
+
+
+class ReplayConsole():
+    '''keeps what the module writes to the console'''
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text, fg='black', bg='white'):
+        self.lines.append(text)
+
+    def writeln(self, text, fg='black', bg='white'):
+        self.lines.append(text)
+
+    def error(self, text):
+        self.lines.append(text)
+
+    def set_status(self, name, text='', row=0, fg='black'):
+        pass
+
+
+class ReplayFunctions():
+    def __init__(self, console, params):
+        self.console = console
+        self.params = params
+
+    def say(self, text, priority='important'):
+        self.console.writeln(text)
+
+    def get_mav_param(self, name, default=None):
+        return self.params.get(name, default)
+
+
+class ReplayStatus():
+    def __init__(self):
+        self.logdir = None
+
+
+class ReplayState():
+    '''the parts of MAVProxy's mpstate a module reaches for'''
+    def __init__(self, master):
+        self._master = master
+        self.settings = ReplaySettings()
+        self.console = ReplayConsole()
+        self.status = ReplayStatus()
+        self.mav_param = {}
+        self.functions = ReplayFunctions(self.console, self.mav_param)
+        self.command_map = {}
+        self.completions = {}
+        self.public_modules = {}
+        self.instance_count = {}
+        self.vehicle_type = 'rover'
+        self.vehicle_name = None
+        self.sitl_output = None
+        self.continue_mode = False
+
+    def master(self):
+        return self._master
+
+    def module(self, name):
+        return self.public_modules.get(name)
+
+
+class Replay():
+    '''
+    a fresh AUVModule fed the TYPES (all by default) of FILENAME between
+    START and END, idle_task running IDLE_RATE times a second of log time.
+    The module reads and writes its maps, calibrations and logs in
+    DATA_DIR, a scratch directory unless one is given, so a replay never
+    touches the files of a real dive. SENSOR_READER stands in for the
+    sensor board, anything with read(channel) returning a reading string;
+    without one sample() is skipped.
+    '''
+    def __init__(self, filename, idle_rate=100.0, data_dir=None, types=None, start=None, end=None,
+                 sensor_reader=None):
+        from MAVProxy.modules import mavproxy_auto
+        self.auto = mavproxy_auto
+        self.index = mp_tlog.TlogIndex(filename)
+        self.entries = self.index.select(types, start, end)
+        self.idle_rate = idle_rate
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix='replay_')
+        self.clock = LogClock()
+        if len(self.entries):
+            self.clock.now = self.entries['time'][0] * 1.0e-6
+        self.master = ReplayMaster(self.clock)
+        self.mpstate = ReplayState(self.master)
+        self.timing = {}  # {type or 'idle_task': [wall seconds per call]}
+        self.errors = {}
+        self.corrupt = 0
+        self.packets = 0
+        self.wall = 0.0
+        self.log = 0.0
+        self.lag = 0.0  # worst wall time behind the requested pace
+        mp_navstate.reset_fusion()  # nothing left over from an earlier replay
+        with self.installed():
+            self.module = mavproxy_auto.init(self.mpstate)
+        if sensor_reader is not None:
+            self.module.sensor_reader = sensor_reader
+
+    @contextlib.contextmanager
+    def installed(self):
+        '''the log clock as time.time and the replay's data directory, for the module only'''
+        data_dir = self.auto.DATA_DIR
+        self.auto.DATA_DIR = self.data_dir
+        time.time = self.clock.time
+        try:
+            yield
+        finally:
+            time.time = _wall_time
+            self.auto.DATA_DIR = data_dir
+
+    def command(self, line):
+        '''run a module command line, such as "auto depth 2", at the current log time'''
+        args = line.split()
+        with self.installed():
+            self.call(args[0], self.mpstate.command_map[args[0]][0], args[1:])
+
+    def call(self, name, fn, *args):
+        '''run one module entry point and time it; exceptions are counted as MAVProxy would print them'''
+        start = _wall_time()
+        self.master.cause = (name, start)
+        try:
+            fn(*args)
+        except Exception as e:
+            key = (name, e.__class__.__name__)
+            if key not in self.errors:
+                self.errors[key] = 0
+                print("%s: %s" % (name, traceback.format_exc().rstrip()))
+            self.errors[key] += 1
+        self.timing.setdefault(name, []).append(_wall_time() - start)
+
+    def pace(self, log_offset, wall_start, speed):
+        if speed <= 0:
+            return
+        delay = wall_start + log_offset / speed - _wall_time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.lag = max(self.lag, -delay)
+
+    def deliver(self, m):
+        mtype = m.get_type()
+        self.master.messages[mtype] = m
+        if mtype == 'HEARTBEAT' and m.get_srcSystem() != 255:
+            self.master.target_system = m.get_srcSystem()
+            self.master.target_component = m.get_srcComponent()
+        self.call(mtype, self.module.mavlink_packet, m)
+        self.packets += 1
+
+    def run(self, speed=0):
+        '''replay every selected packet at SPEED times real time, 0 for as fast as possible'''
+        if not len(self.entries):
+            return
+        times = self.entries['time'] * 1.0e-6
+        log_start = times[0]
+        idle_step = 1.0 / self.idle_rate
+        next_idle = log_start
+        wall_start = _wall_time()
+        with self.installed():
+            for entry, t in zip(self.entries, times):
+                while next_idle <= t:
+                    self.clock.now = next_idle
+                    self.pace(next_idle - log_start, wall_start, speed)
+                    self.call('idle_task', self.module.idle_task)
+                    next_idle += idle_step
+                try:
+                    m = self.index.decode(entry)
+                except Exception:
+                    self.corrupt += 1
+                    continue
+                self.clock.now = t
+                self.pace(t - log_start, wall_start, speed)
+                self.deliver(m)
+        self.wall += _wall_time() - wall_start
+        self.log += times[-1] - log_start
+
+    def sent(self, types=None):
+        '''(log time, latency, cause, message) of everything the module sent, or of TYPES only'''
+        if types is None:
+            return self.master.sent
+        return [s for s in self.master.sent if s[3].get_type() in types]
+
+    def summary(self):
+        '''figures to compare between runs: throughput, time per call and output latency'''
+        handling = {}
+        for name, seconds in self.timing.items():
+            s = numpy.array(seconds)
+            handling[name] = (len(s), s.mean(), numpy.percentile(s, 99), s.max())
+        latency = {}
+        for t, lat, cause, m in self.master.sent:
+            latency.setdefault(m.get_type(), []).append(lat)
+        for mtype, lat in latency.items():
+            lat = numpy.array(lat)
+            latency[mtype] = (len(lat), numpy.percentile(lat, 50), numpy.percentile(lat, 99))
+        return {'packets': self.packets, 'wall': self.wall, 'log': self.log,
+                'speed': self.log / self.wall if self.wall > 0 else 0.0,
+                'rate': self.packets / self.wall if self.wall > 0 else 0.0,
+                'handling': handling, 'latency': latency, 'lag': self.lag,
+                'corrupt': self.corrupt, 'errors': dict(self.errors)}
+
+    def report(self, top=10):
+        '''console lines of the summary'''
+        s = self.summary()
+        lines = ["%u packets, %.1fs of log in %.2fs (%.1fx real time, %.0f packets/s), worst lag %.3fs" % (
+            s['packets'], s['log'], s['wall'], s['speed'], s['rate'], s['lag'])]
+        busiest = sorted(s['handling'].items(), key=lambda x: -x[1][0] * x[1][1])[:top]
+        for name, (n, mean, p99, worst) in busiest:
+            lines.append("  %-24s %8u calls %8.1f us mean %8.1f us p99 %8.1f us max" % (
+                name, n, mean * 1e6, p99 * 1e6, worst * 1e6))
+        for mtype, (n, p50, p99) in sorted(s['latency'].items()):
+            lines.append("  sent %-19s %8u       %8.1f us p50 %8.1f us p99" % (mtype, n, p50 * 1e6, p99 * 1e6))
+        for (name, error), n in sorted(s['errors'].items()):
+            lines.append("  %s raised %s %u times" % (name, error, n))
+        if s['corrupt']:
+            lines.append("  %u packets failed to decode" % s['corrupt'])
+        return lines
+
+    def close(self):
+        self.module.pollution_map.close()
+        self.index.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: mp_replay.py LOG.tlog [SPEED [COMMAND ...]]")
+        sys.exit(1)
+    replay = Replay(sys.argv[1])
+    for line in sys.argv[3:]:
+        replay.command(line)
+    replay.run(float(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    for line in replay.report():
+        print(line)
+    replay.close()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''battery state of charge from a discharge curve table'''
+
+import os
+import numpy
+
+CURVE_FILE = '/home/pi/discharge_curve.txt'
+
+'''resting cell volts and percent remaining of a Li-ion cell like those in the BlueROV2 pack'''
+DEFAULT_CURVE = ([3.00, 3.30, 3.45, 3.55, 3.62, 3.68, 3.74, 3.80, 3.87, 3.95, 4.05, 4.20],
+                 [0.0, 5.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 100.0])
+
+
+def load_curve(filename):
+    '''
+    read a calibration file: one "cell_volts percent" pair per line, in any
+    order, plus an optional "resistance OHMS" line for the pack
+    '''
+    volts = []
+    percent = []
+    resistance = None
+    with open(filename) as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if fields[0] == 'resistance':
+                resistance = float(fields[1])
+            else:
+                volts.append(float(fields[0]))
+                percent.append(float(fields[1]))
+    order = numpy.argsort(volts)
+    return numpy.array(volts)[order], numpy.array(percent)[order], resistance
+
+
+class StateOfCharge():
+    '''
+    Percent remaining from pack voltage and current. The terminal voltage
+    sags under load by current times the pack RESISTANCE, so that drop is
+    added back before the per cell voltage is looked up in the resting
+    discharge curve. Everything works on scalars or whole log arrays alike.
+    '''
+    def __init__(self, volts=None, percent=None, cells=4, resistance=0.05):
+        if volts is None:
+            volts, percent = DEFAULT_CURVE
+        self.volts = numpy.asarray(volts, float)
+        self.percent_table = numpy.asarray(percent, float)
+        self.cells = cells
+        self.resistance = resistance  # ohms for the whole pack
+
+    def cell_percent(self, vcell):
+        '''percent remaining for a resting cell voltage'''
+        p = numpy.interp(vcell, self.volts, self.percent_table)
+        return float(p) if numpy.ndim(p) == 0 else p
+
+    def percent(self, voltage_battery, current_battery, cells=None):
+        '''
+        percent remaining from SYS_STATUS voltage_battery (mV) and
+        current_battery (cA, -1 when not measured)
+        '''
+        volts = numpy.asarray(voltage_battery, float) * 0.001
+        amps = numpy.maximum(numpy.asarray(current_battery, float), 0) * 0.01
+        return self.cell_percent((volts + amps * self.resistance) / (cells or self.cells))
+
+
+def load_soc(filename=CURVE_FILE, cells=4):
+    '''StateOfCharge from a calibration file, or the default curve without one'''
+    if not os.path.exists(filename):
+        return StateOfCharge(cells=cells)
+    volts, percent, resistance = load_curve(filename)
+    if resistance is None:
+        return StateOfCharge(volts, percent, cells)
+    return StateOfCharge(volts, percent, cells, resistance)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+'''
+random access to MAVLink telemetry logs through a sidecar index
+
+A .tlog is a sequence of records, each an 8 byte big endian timestamp in
+microseconds followed by one MAVLink v1 (0xFE) or v2 (0xFD) packet. The
+log is scanned once and the offset, time, message id and source of every
+packet are written next to it as LOG.tlog.idx; later opens load the index
+and jump straight to the packets asked for.
+
+    python mp_tlog.py mav.tlog [ATTITUDE,SYS_STATUS]
+'''
+
+import mmap
+import os
+import struct
+import sys
+import numpy
+
+INDEX_MAGIC = b'TLOGIDX1'
+
+'''16 byte sidecar header: magic, then the size of the log it indexes'''
+HEADER_DTYPE = numpy.dtype([('magic', 'S8'), ('log_size', '<u8')])
+
+ENTRY_DTYPE = numpy.dtype([('offset', '<u8'), ('time', '<u8'), ('msgid', '<u4'),
+                           ('length', '<u2'), ('sysid', 'u1'), ('compid', 'u1')])
+
+MAGIC_V1 = 0xFE
+MAGIC_V2 = 0xFD
+MAX_TIME_STEP = 3600 * 1000000  # a jump of more than an hour means we are not on a record
+
+
+def packet_length(buf, pos):
+    '''(length, msgid, sysid, compid) of the packet starting at POS, None if there is none'''
+    if pos + 8 > len(buf):
+        return None
+    magic = buf[pos]
+    if magic == MAGIC_V1:
+        plen = int(buf[pos + 1])
+        return 8 + plen, buf[pos + 5], buf[pos + 3], buf[pos + 4]
+    if magic == MAGIC_V2:
+        if pos + 10 > len(buf):
+            return None
+        plen = int(buf[pos + 1])
+        signed = 13 if buf[pos + 2] & 0x01 else 0
+        msgid = int(buf[pos + 7]) | (int(buf[pos + 8]) << 8) | (int(buf[pos + 9]) << 16)
+        return 12 + plen + signed, msgid, buf[pos + 5], buf[pos + 6]
+    return None
+
+
+def scan(buf, start=0, end=None):
+    '''
+    index the records of BUF (bytes, bytearray or mmap) from START up to
+    END. Garbage between records is skipped a byte at a time until the
+    next timestamp and packet line up again.
+    '''
+    if end is None:
+        end = len(buf)
+    raw = buf
+    if not isinstance(buf, bytearray) and len(buf):
+        try:
+            buf = memoryview(raw)
+            if not isinstance(buf[0], int):
+                raise TypeError  # python 2 memoryviews index as strings
+        except TypeError:
+            buf = numpy.frombuffer(raw, numpy.uint8)
+    entries = []
+    last_time = None
+    pos = start
+    while pos + 16 <= end:
+        info = packet_length(buf, pos + 8)
+        if info is not None and pos + 8 + info[0] <= len(buf):
+            t = struct.unpack_from('>Q', raw, pos)[0]
+            if last_time is None or abs(t - last_time) < MAX_TIME_STEP:
+                entries.append((pos, t, info[1], info[0], info[2], info[3]))
+                last_time = t
+                pos += 8 + info[0]
+                continue
+        pos += 1
+    return numpy.array(entries, ENTRY_DTYPE)
+
+
+def resync(buf, pos, end=None, count=4):
+    '''
+    the first offset from POS at which COUNT records in a row frame
+    correctly, END if there is none. Used to cut a log into chunks at
+    record boundaries without scanning it from the start.
+    '''
+    if end is None:
+        end = len(buf)
+    raw = buf
+    if not isinstance(buf, bytearray):
+        buf = numpy.frombuffer(raw, numpy.uint8)
+    while pos < end:
+        p = pos
+        last_time = None
+        for _ in range(count):
+            info = packet_length(buf, p + 8)
+            if info is None or p + 8 + info[0] > len(buf):
+                break
+            t = struct.unpack_from('>Q', raw, p)[0]
+            if last_time is not None and abs(t - last_time) >= MAX_TIME_STEP:
+                break
+            last_time = t
+            p += 8 + info[0]
+        else:
+            return pos
+        if p >= len(buf) and last_time is not None:
+            return pos  # the log ended before COUNT records
+        pos += 1
+    return end
+
+
+def message_names():
+    '''{msgid: name} from pymavlink, empty if it is not installed'''
+    try:
+        from pymavlink.dialects.v20 import ardupilotmega as mavlink
+    except ImportError:
+        return {}
+    names = {}
+    for msgid, cls in mavlink.mavlink_map.items():
+        names[msgid] = cls.msgname if hasattr(cls, 'msgname') else cls.name
+    return names
+
+
+class TlogIndex():
+    '''
+    packets of FILENAME by type and time. The sidecar is rebuilt when it
+    is missing, was written for a log of a different size, or REBUILD.
+    '''
+    def __init__(self, filename, rebuild=False, index_filename=None):
+        self.filename = filename
+        self.index_filename = index_filename or filename + '.idx'
+        self.log_size = os.path.getsize(filename)
+        self.entries = None
+        if not rebuild:
+            self.entries = self.load()
+        if self.entries is None:
+            self.entries = self.build()
+            self.save()
+        self.names = message_names()
+        self.ids = dict((name, msgid) for msgid, name in self.names.items())
+        self.f = open(filename, 'rb')
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.log_size else b''
+        self.mav = None
+
+    def build(self):
+        with open(self.filename, 'rb') as f:
+            if self.log_size == 0:
+                return numpy.zeros(0, ENTRY_DTYPE)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return scan(m)
+            finally:
+                m.close()
+
+    def load(self):
+        if not os.path.exists(self.index_filename):
+            return None
+        with open(self.index_filename, 'rb') as f:
+            header = numpy.fromfile(f, HEADER_DTYPE, 1)
+            if len(header) != 1 or header['magic'][0] != INDEX_MAGIC or header['log_size'][0] != self.log_size:
+                return None
+            return numpy.fromfile(f, ENTRY_DTYPE)
+
+    def save(self):
+        header = numpy.zeros(1, HEADER_DTYPE)
+        header['magic'] = INDEX_MAGIC
+        header['log_size'] = self.log_size
+        with open(self.index_filename, 'wb') as f:
+            header.tofile(f)
+            self.entries.tofile(f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def types(self):
+        '''{name: count} of the message types in the log'''
+        ids, counts = numpy.unique(self.entries['msgid'], return_counts=True)
+        return dict((self.names.get(int(i), str(i)), int(n)) for i, n in zip(ids, counts))
+
+    def msgids(self, types):
+        out = []
+        for t in types:
+            if t in self.ids:
+                out.append(self.ids[t])
+            elif str(t).isdigit():
+                out.append(int(t))
+        return out
+
+    def select(self, types=None, start=None, end=None):
+        '''index entries of the given TYPES (names or ids) between START and END (seconds since the epoch)'''
+        mask = numpy.ones(len(self.entries), bool)
+        if types is not None:
+            mask &= numpy.isin(self.entries['msgid'], self.msgids(types))
+        if start is not None:
+            mask &= self.entries['time'] >= int(start * 1e6)
+        if end is not None:
+            mask &= self.entries['time'] < int(end * 1e6)
+        return self.entries[mask]
+
+    def packet(self, entry):
+        '''raw bytes of the packet of one index entry'''
+        offset = int(entry['offset']) + 8
+        return self.map[offset:offset + int(entry['length'])]
+
+    def decode(self, entry):
+        '''the pymavlink message of one index entry, with _timestamp set'''
+        if self.mav is None:
+            from pymavlink.dialects.v20 import ardupilotmega as mavlink
+            self.mav = mavlink.MAVLink(None)
+            self.mav.robust_parsing = True
+        m = self.mav.decode(bytearray(self.packet(entry)))
+        m._timestamp = float(entry['time']) * 1.0e-6
+        return m
+
+    def messages(self, types=None, start=None, end=None):
+        '''decode the selected packets in log order'''
+        for entry in self.select(types, start, end):
+            try:
+                yield self.decode(entry)
+            except Exception:
+                continue  # corrupt packet that happened to frame correctly
+
+    def close(self):
+        if self.log_size:
+            self.map.close()
+        self.f.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: mp_tlog.py LOG.tlog [TYPE,...]")
+        sys.exit(1)
+    index = TlogIndex(sys.argv[1])
+    if len(sys.argv) == 2:
+        for name, count in sorted(index.types().items()):
+            print("%-28s %8u" % (name, count))
+    else:
+        for m in index.messages(sys.argv[2].split(',')):
+            print("%.3f %s" % (m._timestamp, m))
+    index.close()
@@ -191,6 +191,19 @@ class WPManager():
             self.wploader.add_latlonalt(p[0], p[1], self.settings.wpalt, terrain_alt=use_terrain)
         self.send_all_waypoints()
 
+    def load_points(self, points, alt=0):
+        '''replace the mission with waypoints at the given (lat, lng) points'''
+        home = self.get_home()
+        self.wploader.clear()
+        self.wploader.target_system = self.target_system
+        self.wploader.target_component = self.target_component
+        if home is not None:
+            self.wploader.add(home)
+        for p in points:
+            self.wploader.add_latlonalt(p[0], p[1], alt)
+        print("Loaded %u waypoints" % len(points))
+        self.send_all_waypoints()
+
     def wp_loop(self):
         '''close the loop on a mission'''
         loader = self.wploader
@@ -0,0 +1,5 @@
+'''Python simulator for the sparse/dense adaptive sampling strategies'''
+
+from .auv import AUV, sources_found, evaluate
+from .poi import merge_points
+from .world import create_world, gen_interest, generate_world, plume_table
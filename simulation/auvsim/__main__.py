@@ -0,0 +1,25 @@
+'''run the TestScript.m configuration on a batch of seeded worlds'''
+
+import argparse
+import time
+
+from .auv import evaluate
+from .world import create_world
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--runs', type=int, default=100)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--step', type=int, default=10)
+args = parser.parse_args()
+
+start = time.time()
+found = energy = coverage = 0.0
+for seed in range(args.seed, args.seed + args.runs):
+    world, sources = create_world(seed)
+    result = evaluate(world, sources, step_size=args.step)
+    found += float(result['sources_found']) / result['sources']
+    energy += result['energy']
+    coverage += result['coverage']
+elapsed = time.time() - start
+print("%u runs in %.2fs: mean energy %.0f, coverage %.1f%%, sources found %.1f%%" % (
+    args.runs, elapsed, energy / args.runs, 100 * coverage / args.runs, 100 * found / args.runs))
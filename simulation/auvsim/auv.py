@@ -0,0 +1,231 @@
+'''
+Vectorised port of the sparse/dense traversal simulator in AUV.m.
+
+Positions are 0-based (row, column) cells of the world grid, with (0, 0) the
+top left corner. 'N'/'S' move along rows and 'E'/'W' along columns, as in
+AUV.m. Instead of moving one cell per call, every straight leg is computed as
+an index range and sampled from the world with fancy indexing.
+'''
+
+import numpy
+
+from .poi import merge_points
+
+STEP = {'N': (-1, 0), 'S': (1, 0), 'E': (0, 1), 'W': (0, -1)}
+OPPOSITE = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+CLOCKWISE = {'N': 'E', 'E': 'S', 'S': 'W', 'W': 'N'}
+
+
+class AUV():
+    '''simulated vehicle with the strategies of AUV.m'''
+    def __init__(self, x=0, y=0, velocity=1, border_x=100, border_y=100):
+        self.position_x = x
+        self.position_y = y
+        self.velocity = velocity
+        self.border_x = border_x
+        self.border_y = border_y
+        self.energy = 0  # successful steps, as in AUV.m
+        self.current_knowledge = numpy.zeros([border_x, border_y])
+        self.sampled = numpy.zeros([border_x, border_y], bool)
+        self.points_of_interest = []  # arrays of (x, y) rows
+        self.pollution_sources = []
+        self.path_x = [numpy.array([x])]
+        self.path_y = [numpy.array([y])]
+
+    def path(self):
+        '''every cell the AUV has occupied, in order'''
+        return numpy.concatenate(self.path_x), numpy.concatenate(self.path_y)
+
+    def coverage(self):
+        '''fraction of the world that has been sampled'''
+        return self.sampled.mean()
+
+    def steps_available(self, direction):
+        '''number of full velocity steps before the border'''
+        dx, dy = STEP[direction]
+        if dx > 0:
+            room = self.border_x - 1 - self.position_x
+        elif dx < 0:
+            room = self.position_x
+        elif dy > 0:
+            room = self.border_y - 1 - self.position_y
+        else:
+            room = self.position_y
+        return room // self.velocity
+
+    def leg_cells(self, direction, n, stop_at_edge=True):
+        '''
+        cells visited by N sample-then-move iterations from the current position.
+        Returns the sampled cells and the number of successful moves. With
+        STOP_AT_EDGE the loop breaks at the border like the sparse and dense
+        loops in AUV.m, otherwise it keeps sampling in place like squareTraverse.
+        '''
+        dx, dy = STEP[direction]
+        moves = min(n, self.steps_available(direction))
+        if stop_at_edge:
+            count = n if moves == n else moves + 1
+            i = numpy.arange(count)
+        else:
+            i = numpy.minimum(numpy.arange(n), moves)
+        xs = self.position_x + dx * self.velocity * i
+        ys = self.position_y + dy * self.velocity * i
+        return xs, ys, moves
+
+    def move(self, direction, moves):
+        '''advance MOVES velocity steps, recording the path'''
+        if moves <= 0:
+            return
+        dx, dy = STEP[direction]
+        i = numpy.arange(1, moves + 1) * self.velocity
+        self.path_x.append(self.position_x + dx * i)
+        self.path_y.append(self.position_y + dy * i)
+        self.position_x += dx * self.velocity * moves
+        self.position_y += dy * self.velocity * moves
+        self.energy += moves
+
+    def sample(self, world, xs, ys):
+        '''read the world at the given cells into current_knowledge'''
+        values = world[xs, ys]
+        self.current_knowledge[xs, ys] = values
+        self.sampled[xs, ys] = True
+        return values
+
+    def leg(self, world, direction, n, stop_at_edge=True):
+        '''sample and move along a straight leg, returning the samples'''
+        xs, ys, moves = self.leg_cells(direction, n, stop_at_edge)
+        values = self.sample(world, xs, ys)
+        self.move(direction, moves)
+        return xs, ys, values
+
+    def square_traverse(self, world, step_size, end_point):
+        '''expanding square spiral'''
+        direction = 'N'
+        for n in range(1, end_point + 1):
+            for _ in range(2):
+                self.leg(world, direction, n + step_size, stop_at_edge=False)
+                direction = CLOCKWISE[direction]
+
+    def point_to_point(self, target_x, target_y):
+        '''diagonal then straight transit without sampling'''
+        if not (0 <= target_x < self.border_x and 0 <= target_y < self.border_y):
+            return
+        nx = abs(target_x - self.position_x) // self.velocity
+        ny = abs(target_y - self.position_y) // self.velocity
+        sx = 1 if target_x >= self.position_x else -1
+        sy = 1 if target_y >= self.position_y else -1
+        diagonal = min(nx, ny)
+        i = numpy.arange(1, max(nx, ny) + 1)
+        self.path_x.append(self.position_x + sx * self.velocity * numpy.minimum(i, nx))
+        self.path_y.append(self.position_y + sy * self.velocity * numpy.minimum(i, ny))
+        self.position_x += sx * self.velocity * nx
+        self.position_y += sy * self.velocity * ny
+        self.energy += 2 * diagonal + (nx - diagonal) + (ny - diagonal)
+
+    def dense_traverse(self, world, step_size, distance_long, distance_short,
+                       direction_long, direction_short):
+        '''tight lawnmower around the current cell, returning the peak cell'''
+        best = [-numpy.inf, (self.position_x, self.position_y)]
+
+        def track(xs, ys, values):
+            if len(values):
+                i = int(numpy.argmax(values))
+                if values[i] > best[0]:
+                    best[0] = values[i]
+                    best[1] = (int(xs[i]), int(ys[i]))
+
+        track(*self.leg(world, direction_long, distance_long // 2))
+        direction_long = OPPOSITE[direction_long]
+        for _ in range(1, distance_short + 1, step_size):
+            track(*self.leg(world, direction_short, step_size))
+            track(*self.leg(world, direction_long, distance_long))
+            direction_long = OPPOSITE[direction_long]
+        # come back onto the path the AUV was following
+        track(*self.leg(world, direction_short, step_size))
+        track(*self.leg(world, direction_long, distance_long // 2))
+        return best[1]
+
+    def sparse_leg(self, world, direction, n, threshold, dense_params, dense_directions):
+        '''
+        sampled leg that records points of interest and breaks into a dense
+        traverse at every reading above threshold[1]. Returns True at the border.
+        '''
+        lo, hi = threshold
+        while n > 0:
+            xs, ys, moves = self.leg_cells(direction, n)
+            trigger = numpy.nonzero(world[xs, ys] >= hi)[0]
+            end = trigger[0] + 1 if len(trigger) else len(xs)
+            xs = xs[:end]
+            ys = ys[:end]
+            keep = self.sample(world, xs, ys) > lo
+            if keep.any():
+                self.points_of_interest.append(numpy.stack([xs[keep], ys[keep]], axis=1))
+            if not len(trigger):
+                self.move(direction, moves)
+                return moves < n
+            # stop on the triggering cell, inspect it, then take that iteration's step
+            self.move(direction, int(trigger[0]))
+            self.pollution_sources.append(self.dense_traverse(world, *(tuple(dense_params) + dense_directions)))
+            n -= int(trigger[0]) + 1
+            if self.steps_available(direction) < 1:
+                return True
+            self.move(direction, 1)
+        return False
+
+    def sparse_traverse(self, world, step_size, threshold, direction_long, direction_short,
+                        dense_params, merge_distance=3):
+        '''lawnmower over the whole world, then visit the points of interest'''
+        if direction_long in ('E', 'W'):
+            long_lim, short_lim = self.border_y, self.border_x
+        else:
+            long_lim, short_lim = self.border_x, self.border_y
+        for _ in range(0, short_lim, step_size):
+            self.sparse_leg(world, direction_long, long_lim - 1, threshold, dense_params,
+                            (direction_short, direction_long))
+            direction_long = OPPOSITE[direction_long]
+            self.sparse_leg(world, direction_short, step_size, threshold, dense_params,
+                            (direction_long, direction_short))
+        # last leg, otherwise the final row is never sampled
+        self.sparse_leg(world, direction_long, long_lim, threshold, dense_params,
+                        (direction_short, direction_long))
+        self.nearest_neighbour_traverse(world, dense_params, direction_long, direction_short, merge_distance)
+
+    def nearest_neighbour_traverse(self, world, dense_params, direction_long, direction_short,
+                                   merge_distance=3):
+        '''visit the merged points of interest greedily, dense traversing each'''
+        if not self.points_of_interest:
+            return
+        poi = numpy.concatenate(self.points_of_interest)
+        centroids = merge_points(poi, merge_distance, self.current_knowledge[poi[:, 0], poi[:, 1]])[0]
+        poi = numpy.rint(centroids).astype(int)
+        self.points_of_interest = []
+        remaining = numpy.ones(len(poi), bool)
+        while remaining.any():
+            d = (poi[:, 0] - self.position_x) ** 2 + (poi[:, 1] - self.position_y) ** 2
+            d = numpy.where(remaining, d, numpy.inf)
+            i = int(numpy.argmin(d))
+            remaining[i] = False
+            self.point_to_point(int(poi[i, 0]), int(poi[i, 1]))
+            self.pollution_sources.append(self.dense_traverse(world, *(tuple(dense_params) +
+                                                                       (direction_long, direction_short))))
+
+
+def sources_found(found, sources, tolerance=5):
+    '''number of true SOURCES with a reported source within TOLERANCE cells'''
+    if not len(found) or not len(sources):
+        return 0
+    found = numpy.asarray(found, float)
+    sources = numpy.asarray(sources, float)
+    d = numpy.hypot(sources[:, None, 0] - found[None, :, 0], sources[:, None, 1] - found[None, :, 1])
+    return int((d.min(axis=1) <= tolerance).sum())
+
+
+def evaluate(world, sources, step_size=10, threshold=(0.3, 0.7), dense_params=(2, 5, 5),
+             direction_long='E', direction_short='S', tolerance=5):
+    '''run the full sparse/dense strategy on WORLD and summarise it'''
+    auv = AUV(border_x=world.shape[0], border_y=world.shape[1])
+    auv.sparse_traverse(world, step_size, threshold, direction_long, direction_short, dense_params)
+    return {'energy': auv.energy,
+            'coverage': auv.coverage(),
+            'dense_traverses': len(auv.pollution_sources),
+            'sources_found': sources_found(auv.pollution_sources, sources, tolerance),
+            'sources': len(sources)}
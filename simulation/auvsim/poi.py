@@ -0,0 +1,20 @@
+'''
+Point of interest merging and tour planning, shared with the onboard module.
+mp_poi is taken from an installed MAVProxy when the auto module has been
+deployed there, otherwise straight from mavproxy_auto in this tree; it only
+needs numpy either way.
+'''
+
+import importlib.util
+import os
+
+try:
+    from MAVProxy.modules import mp_poi
+except ImportError:
+    _spec = importlib.util.spec_from_file_location('mp_poi', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', 'mavproxy_auto', 'mp_poi.py'))
+    mp_poi = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(mp_poi)
+
+merge_points = mp_poi.merge_points
+plan_tour = mp_poi.plan_tour
@@ -0,0 +1,182 @@
+'''
+Parameter sweep over the sparse/dense strategy.
+
+Every combination of sparse step size, thresholds, dense traverse parameters
+and world seed is one run. Runs are spread over a process pool and each result
+is appended to a column store: a directory holding one raw little-endian file
+per column. Running a sweep into an existing directory skips the runs that
+are already there, so an interrupted or extended sweep picks up where it stopped.
+
+    python -m auvsim.sweep results --steps 5,10,15 --lo 0.2,0.3 --hi 0.6,0.7 \
+        --dense 2:5:5,3:7:7 --seeds 50
+    python -m auvsim.sweep results --summary
+'''
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy
+
+from .auv import evaluate
+from .world import create_world
+
+COLUMNS = [('step_size', '<i4'), ('lo', '<f8'), ('hi', '<f8'),
+           ('dense_step', '<i4'), ('dense_long', '<i4'), ('dense_short', '<i4'), ('seed', '<i8'),
+           ('energy', '<i8'), ('coverage', '<f8'), ('dense_traverses', '<i4'),
+           ('sources_found', '<i4'), ('sources', '<i4')]
+PARAMETERS = ['step_size', 'lo', 'hi', 'dense_step', 'dense_long', 'dense_short']
+RUN_KEY = PARAMETERS + ['seed']
+
+
+class ColumnStore():
+    '''append-only table kept as one binary file per column'''
+    def __init__(self, directory, columns=COLUMNS):
+        self.directory = directory
+        self.dtype = numpy.dtype(columns)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        schema = os.path.join(directory, 'schema.json')
+        if os.path.exists(schema):
+            with open(schema) as f:
+                if [tuple(c) for c in json.load(f)] != [tuple(c) for c in columns]:
+                    raise ValueError("%s holds a different table" % directory)
+        else:
+            with open(schema, 'w') as f:
+                json.dump(columns, f)
+        self.files = {}
+        rows = min(self.column_rows(name) for name in self.dtype.names)
+        for name in self.dtype.names:
+            # drop a half written last row left by an interrupted sweep
+            path = self.column_path(name)
+            with open(path, 'ab') as f:
+                f.truncate(rows * self.dtype[name].itemsize)
+            self.files[name] = open(path, 'ab')
+
+    def column_path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def column_rows(self, name):
+        path = self.column_path(name)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // self.dtype[name].itemsize
+
+    def append(self, rows):
+        '''append a structured array of rows'''
+        rows = numpy.asarray(rows, self.dtype)
+        for name in self.dtype.names:
+            rows[name].tofile(self.files[name])
+        for name in self.dtype.names:
+            self.files[name].flush()
+
+    def column(self, name):
+        return numpy.fromfile(self.column_path(name), self.dtype[name])
+
+    def read(self):
+        '''the whole table as a structured array'''
+        columns = [self.column(name) for name in self.dtype.names]
+        rows = min(len(c) for c in columns)
+        table = numpy.zeros(rows, self.dtype)
+        for name, c in zip(self.dtype.names, columns):
+            table[name] = c[:rows]
+        return table
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def grid(steps, los, his, dense, seeds):
+    '''every run of the sweep as a RUN_KEY tuple'''
+    for step, lo, hi, d, seed in itertools.product(steps, los, his, dense, seeds):
+        if lo < hi:
+            yield (step, lo, hi) + tuple(d) + (seed,)
+
+
+def run_one(params):
+    '''worker: evaluate one configuration on one seeded world'''
+    step, lo, hi, dense_step, dense_long, dense_short, seed = params
+    world, sources = create_world(seed)
+    r = evaluate(world, sources, step_size=step, threshold=(lo, hi),
+                 dense_params=(dense_step, dense_long, dense_short))
+    return params + (r['energy'], r['coverage'], r['dense_traverses'],
+                     r['sources_found'], r['sources'])
+
+
+def sweep(directory, runs, processes=None, batch=64):
+    '''evaluate RUNS not already in DIRECTORY, streaming results to it'''
+    store = ColumnStore(directory)
+    table = store.read()
+    done = set(zip(*[table[name].tolist() for name in RUN_KEY]))
+    todo = [r for r in runs if r not in done]
+    pool = multiprocessing.Pool(processes)
+    pending = []
+    try:
+        for result in pool.imap_unordered(run_one, todo, chunksize=8):
+            pending.append(result)
+            if len(pending) >= batch:
+                store.append(pending)
+                pending = []
+    finally:
+        if pending:
+            store.append(pending)
+        pool.terminate()
+        store.close()
+    return len(todo)
+
+
+def summary(directory, top=10):
+    '''rank configurations by sources found per unit of energy'''
+    store = ColumnStore(directory)
+    table = store.read()
+    store.close()
+    if not len(table):
+        return []
+    keys = numpy.stack([table[p].astype(float) for p in PARAMETERS], axis=1)
+    unique, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    n = numpy.bincount(inverse)
+    found = numpy.bincount(inverse, table['sources_found'].astype(float) / table['sources'])
+    energy = numpy.bincount(inverse, table['energy'].astype(float))
+    score = found / energy
+    ranked = []
+    for i in numpy.argsort(-score)[:top]:
+        ranked.append(dict(zip(PARAMETERS, unique[i]), runs=int(n[i]),
+                           found=100 * found[i] / n[i], energy=energy[i] / n[i]))
+    return ranked
+
+
+def parse_list(text, kind):
+    return [kind(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sparse/dense parameter sweep')
+    parser.add_argument('directory')
+    parser.add_argument('--steps', default='10')
+    parser.add_argument('--lo', default='0.3')
+    parser.add_argument('--hi', default='0.7')
+    parser.add_argument('--dense', default='2:5:5', help='step:long:short,...')
+    parser.add_argument('--seeds', type=int, default=20)
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--summary', action='store_true')
+    args = parser.parse_args()
+
+    if not args.summary:
+        dense = [tuple(int(v) for v in d.split(':')) for d in args.dense.split(',')]
+        seeds = range(args.first_seed, args.first_seed + args.seeds)
+        runs = grid(parse_list(args.steps, int), parse_list(args.lo, float),
+                    parse_list(args.hi, float), dense, seeds)
+        count = sweep(args.directory, runs, args.processes)
+        print("%u runs evaluated" % count)
+    for r in summary(args.directory):
+        print("step %(step_size)2.0f lo %(lo).2f hi %(hi).2f dense %(dense_step).0f:%(dense_long).0f:%(dense_short).0f"
+              "  runs %(runs)4u  found %(found)5.1f%%  energy %(energy)6.0f" % r)
+
+
+if __name__ == '__main__':
+    main()
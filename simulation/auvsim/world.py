@@ -0,0 +1,99 @@
+'''Python port of createWorld.m and genInteres.m, plus a large seeded world generator'''
+
+import numpy
+
+
+def gen_interest(a=5, sigma=((0.25, 0.3), (0.3, 1.0))):
+    '''(2a+1) square bivariate normal bump scaled to a peak of 1'''
+    x1, x2 = numpy.meshgrid(numpy.arange(-a, a + 1), numpy.arange(-a, a + 1))
+    points = numpy.stack([x1.ravel(), x2.ravel()], axis=1)
+    inverse = numpy.linalg.inv(numpy.asarray(sigma))
+    f = numpy.exp(-0.5 * numpy.einsum('ij,jk,ik->i', points, inverse, points))
+    return f.reshape(x1.shape) / f.max()
+
+
+def create_world(seed=None, size=100, regions=6, background=0.3, a=5):
+    '''
+    uniform background noise with REGIONS plumes added at random places.
+    Returns the world and the (row, column) centre of every plume.
+    '''
+    rng = numpy.random.RandomState(seed)
+    world = background * rng.rand(size, size)
+    bump = gen_interest(a)
+    width = 2 * a + 1
+    sources = []
+    for _ in range(regions):
+        b, c = rng.randint(0, size - width + 1, 2)
+        world[b:b + width, c:c + width] += bump
+        sources.append((b + a, c + a))
+    return world, numpy.array(sources)
+
+
+def plume_table(seed, rows, cols, plumes, sigma=(2.0, 8.0), current=None):
+    '''
+    random plumes for generate_world: one (row, col, peak, sigma_major,
+    sigma_minor, angle) record per plume. With a CURRENT direction in degrees
+    every plume is stretched along it instead of at a random angle.
+    '''
+    rng = numpy.random.RandomState(seed)
+    table = numpy.zeros(plumes, [('row', 'f8'), ('col', 'f8'), ('peak', 'f8'),
+                                 ('major', 'f8'), ('minor', 'f8'), ('angle', 'f8')])
+    table['row'] = rng.rand(plumes) * rows
+    table['col'] = rng.rand(plumes) * cols
+    table['peak'] = 0.5 + 0.5 * rng.rand(plumes)
+    table['minor'] = sigma[0] + (sigma[1] - sigma[0]) * rng.rand(plumes)
+    table['major'] = table['minor'] * (1 + 2 * rng.rand(plumes))
+    if current is None:
+        table['angle'] = numpy.pi * rng.rand(plumes)
+    else:
+        table['angle'] = numpy.radians(current)
+    return table
+
+
+def add_plume(block, first_row, p):
+    '''add rotated gaussian plume P to BLOCK, which starts at world row FIRST_ROW'''
+    reach = 4 * p['major']
+    r0 = max(int(p['row'] - reach), first_row)
+    r1 = min(int(p['row'] + reach) + 1, first_row + block.shape[0])
+    c0 = max(int(p['col'] - reach), 0)
+    c1 = min(int(p['col'] + reach) + 1, block.shape[1])
+    if r0 >= r1 or c0 >= c1:
+        return
+    dr = numpy.arange(r0, r1)[:, None] - p['row']
+    dc = numpy.arange(c0, c1)[None, :] - p['col']
+    cos, sin = numpy.cos(p['angle']), numpy.sin(p['angle'])
+    along = dr * cos + dc * sin
+    across = -dr * sin + dc * cos
+    block[r0 - first_row:r1 - first_row, c0:c1] += p['peak'] * numpy.exp(
+        -0.5 * ((along / p['major']) ** 2 + (across / p['minor']) ** 2))
+
+
+def generate_world(filename, rows, cols, seed=0, plumes=None, background=0.3,
+                   drift=(0.0, 0.0), current=None, chunk_rows=512, dtype='f4'):
+    '''
+    write a ROWS x COLS world to the .npy file FILENAME one block of rows at a
+    time, so worlds far larger than memory can be built. The background noise
+    of every row comes from its own seeded generator, so the result only
+    depends on SEED, not on CHUNK_ROWS. DRIFT adds a linear trend of
+    (per full height, per full width). Returns the world opened read-only
+    through a memory map and the plume table.
+    '''
+    if plumes is None:
+        plumes = max(1, rows * cols // 2000)
+    table = plume_table(seed, rows, cols, plumes, current=current)
+    world = numpy.lib.format.open_memmap(filename, 'w+', dtype, (rows, cols))
+    trend = drift[1] * numpy.arange(cols) / float(cols)
+    reach = 4 * table['major']
+    for first in range(0, rows, chunk_rows):
+        last = min(first + chunk_rows, rows)
+        block = numpy.empty([last - first, cols])
+        for r in range(first, last):
+            block[r - first] = background * numpy.random.RandomState([seed, r]).rand(cols)
+        block += trend + drift[0] * numpy.arange(first, last)[:, None] / float(rows)
+        near = (table['row'] + reach >= first) & (table['row'] - reach < last)
+        for p in table[near]:
+            add_plume(block, first, p)
+        world[first:last] = block
+    world.flush()
+    del world
+    return numpy.load(filename, mmap_mode='r'), table
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mavproxy_auto'))
+
+import mp_gradient
+
+
+def test_resync_matches_recompute():
+    g = mp_gradient.GradientEstimator(window=20, resync=50)
+    rng = numpy.random.RandomState(0)
+    for i in range(173):
+        x, y = rng.uniform(-100, 100, 2)
+        g.add(x, y, 0.5 * x - 0.25 * y + rng.normal())
+        s = g.samples[:g.count]
+        direct = numpy.array([[1.0, a, b, a * a, a * b, b * b, v, a * v, b * v] for a, b, v in s]).sum(axis=0)
+        assert numpy.allclose(g.sums, direct)
+    assert g.updates > g.resync
+    b, c = g.gradient()
+    assert abs(b - 0.5) < 0.1 and abs(c + 0.25) < 0.1